@@ -1,303 +1,3665 @@
-import tkinter as tk
-from tkinter import filedialog, ttk, messagebox
 import mido
 import numpy as np
-import sounddevice as sd
 import threading
-import wave
 import traceback
 import time
+import sys
+import os
+import json
+import argparse
+import hashlib
+import numbers
+import platform
+import tempfile
+import shutil
+import tracemalloc
+import io
+import base64
+import socketserver
+import signal
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, CancelledError, as_completed
+
+# GUI und Audioausgabe sind optional, damit der Renderer auch headless läuft
+try:
+    import tkinter as tk
+    from tkinter import filedialog, ttk, messagebox
+except ImportError:
+    tk = None
+
+try:
+    import sounddevice as sd
+except (ImportError, OSError):
+    sd = None
+
+try:
+    import rtmidi
+except ImportError:
+    rtmidi = None
+
+# JIT für den fusionierten Synthese-Kernel, ohne numba rechnet die NumPy Referenz
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Pegel, unter dem ein ausklingender Drum-Hit als still gilt (-80 dB)
+SILENCE_LEVEL = 1e-4
+PARAM_SMOOTHING = 0.005  # Sekunden, Zeitkonstante für gleitende Volume/Pan Änderungen
+
+# Stimmtypen, Envelope-Phasen und Wellenformen als kleine Integer für die Voice-Arrays
+KIND_MELODY, KIND_KICK, KIND_SNARE = 0, 1, 2
+SNARE_MIN_NOTE = 38  # Drum-Noten darunter sind Kicks
+ENV_ATTACK, ENV_DECAY, ENV_SUSTAIN, ENV_RELEASE, ENV_OFF = range(5)
+WAVEFORMS = ("Pulse", "Triangle", "Sawtooth")
+
+# NES Noise Kanal: Taktteiler (NTSC CPU Takte) je Period-Index 0..15, schnell -> langsam
+NES_CPU_CLOCK = 1789773
+NES_NOISE_PERIODS = (4, 8, 16, 32, 64, 96, 128, 160, 202, 254, 380, 508, 762, 1016, 2034, 4068)
+
+_lfsr_tables = {}
+
+
+def lfsr_table(short=False):
+    """Eine komplette Periode des 15-Bit LFSR wie im NES/Game Boy als +-1 Tabelle.
+
+    Long Mode (Abgriff Bit 1) wiederholt sich nach 32767 Schritten, Short Mode
+    (Abgriff Bit 6) schon nach 93 Schritten und klingt dadurch metallisch.
+    """
+    table = _lfsr_tables.get(short)
+    if table is None:
+        tap = 6 if short else 1
+        reg, out = 1, []
+        while True:
+            out.append(1.0 - 2.0 * (reg & 1))
+            feedback = (reg ^ (reg >> tap)) & 1
+            reg = (reg >> 1) | (feedback << 14)
+            if reg == 1:
+                break
+        table = _lfsr_tables[short] = np.array(out)
+    return table
+
+
+def lfsr_noise(frames, sample_rate, period=0, short=False):
+    # LFSR mit NES Takt auslesen, Index läuft über das Tabellenende hinaus im Kreis
+    table = lfsr_table(short)
+    clock = NES_CPU_CLOCK / NES_NOISE_PERIODS[int(period)]
+    steps = (np.arange(frames) * (clock / sample_rate)).astype(np.int64)
+    return table[steps % len(table)]
+
+
+# Sortierschlüssel der Stimmen im Kernel: Melodie = Wellenform * 2 + Envelope, Drums = 8 * Art.
+# searchsorted auf diese Werte liefert die Grenzen der Gruppen.
+VOICE_GROUPS = np.array([0, 1, 2, 3, 4, 5, 6, 8, 9, 16, 17])
+
+# Numerische Kanaleinstellungen, die pro Block als Tabelle gelesen werden
+CHANNEL_NUMERIC = (
+    "volume", "pulse_width", "pan",
+    "env_enabled", "attack", "decay", "sustain", "release",
+    "pw_enabled", "pw_start", "pw_stop", "pw_bounce", "pw_bounce_time",
+    "vibrato_depth", "vibrato_rate",
+)
+
+
+class VoicePool:
+    """Feste Anzahl Stimmen als NumPy Arrays (Structure of Arrays).
+
+    Stimmen sind über (Kanal, Note) adressiert, damit zwei Kanäle auf derselben
+    Tonhöhe sich nicht gegenseitig überschreiben.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.active = np.zeros(capacity, dtype=np.bool_)
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.channel = np.zeros(capacity, dtype=np.int16)
+        self.note = np.zeros(capacity, dtype=np.int16)
+        self.freq = np.zeros(capacity)
+        self.vel = np.zeros(capacity)
+        self.start = np.zeros(capacity, dtype=np.int64)
+        # Phasenakkumulator des Oszillators in Perioden, [0, 1)
+        self.phase = np.zeros(capacity)
+        # Sample, an dem ein Note Off ohne Envelope die Stimme beendet hat (-1: nie). Ein
+        # Anschlag derselben Note am selben Sample übernimmt den Slot samt Phase
+        self.stop = np.full(capacity, -1, dtype=np.int64)
+
+        # Envelope Zustand
+        self.env_phase = np.zeros(capacity, dtype=np.int8)
+        self.env_level = np.zeros(capacity)
+        self.release_level = np.zeros(capacity)
+
+    def clear(self):
+        self.active[:] = False
+        self.stop[:] = -1
+
+    def find(self, channel, note):
+        hit = np.flatnonzero(self.active & (self.channel == channel) & (self.note == note))
+        return int(hit[0]) if hit.size else -1
+
+    def allocate(self, channel, note, loudness=None, now=None):
+        # Gleiche (Kanal, Note) wird neu angeschlagen, sonst freier Slot, sonst wird eine
+        # Stimme geklaut: zuerst losgelassene, dann die leiseste, bei Gleichstand die älteste.
+        # Slots, die bei Sample now gerade frei geworden sind, bleiben möglichst ihrer Note
+        # (ein Anschlag am selben Sample übernimmt dort die Phase)
+        slot = self.find(channel, note)
+        if slot < 0:
+            free = np.flatnonzero(~self.active)
+            if free.size:
+                just = self.stop[free] == now
+                same = free[just & (self.channel[free] == channel) & (self.note[free] == note)]
+                other = free[~just]
+                slot = int(same[0] if same.size else other[0] if other.size else free[0])
+            else:
+                held = self.env_phase < ENV_RELEASE
+                if loudness is None:
+                    loudness = self.vel
+                slot = int(np.lexsort((self.start, loudness, held))[0])
+        return slot
+
+
+# Iterationspuffer (Elemente) für NumPy beim Rendern in Echtzeit. Bei Broadcasts wie
+# wave += phase[:, None] legt NumPy pro Operand einen Puffer an, solange eine Zeile kürzer
+# als np.getbufsize() (8192) ist. Ab RENDER_BUFSIZE Frames braucht es keinen, darunter
+# bleibt er klein
+RENDER_BUFSIZE = 256
+
+# Event Typen in der EventQueue
+# EVENT_RELEASE_ALL lässt alle Melodie-Stimmen ausklingen (Seek, Loop-Sprung)
+# EVENT_PITCH_BEND: Pitchwheel eines Kanals, der Wert (-8192..8191) steht im velocity Feld
+EVENT_NOTE_OFF, EVENT_NOTE_ON, EVENT_RELEASE_ALL, EVENT_PITCH_BEND = 0, 1, 2, 3
+# Reihenfolge bei gleichem Sample: Offs, dann Pitch Bends, dann Ons (neue Noten starten schon gebogen)
+EVENT_ORDER = np.array([0, 2, 3, 1])
+PITCH_BEND_RANGE = 2.0  # Halbtöne bei vollem Pitchwheel Ausschlag
+
+
+class EventQueue:
+    """Ringpuffer für Note Events mit Ziel-Sample (ein Producer, ein Consumer).
+
+    Der Sequencer schreibt Events vorab und in zeitlicher Reihenfolge hinein, der Audio
+    Callback liest sie und setzt sie genau auf ihr Sample. Ohne Lock: der Producer
+    schreibt nur tail, der Consumer nur head, und der Slot wird vor dem Weiterschieben
+    von tail beschrieben.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.head = 0
+        self.tail = 0
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def push(self, sample, event, note=0, velocity=0, channel=0, drum=None, age=0):
+        # False, wenn der Puffer voll ist, der Producer muss dann kurz warten.
+        # age > 0: Note On einer Stimme, die schon so viele Samples klingt (nach einem Seek)
+        if self.tail - self.head >= self.capacity:
+            return False
+        self.slots[self.tail % self.capacity] = (sample, event, note, velocity, channel, drum, age)
+        self.tail += 1
+        return True
+
+    def peek(self):
+        if self.head == self.tail:
+            return None
+        return self.slots[self.head % self.capacity]
+
+    def pop(self):
+        ev = self.peek()
+        if ev is not None:
+            # Slot freigeben, sonst hält der Ring bis zu capacity alte Events fest
+            self.slots[self.head % self.capacity] = None
+            self.head += 1
+        return ev
+
+    def clear(self):
+        # Nur aufrufen, wenn kein Stream läuft
+        self.head = self.tail = 0
+
+
+class RenderBuffer:
+    """Ringpuffer für vorgerenderte Stereo-Samples (ein Producer, ein Consumer).
+
+    written und read zählen absolute Sample-Indizes, der Render Thread schreibt nur
+    written, der Audio Callback nur read.
+    """
+
+    def __init__(self, capacity, start=0):
+        self.capacity = capacity
+        self.data = np.zeros((capacity, 2), dtype=np.float32)
+        self.start = start
+        self.written = start
+        self.read = start
+
+    def available(self):
+        return self.written - self.read
+
+    def free(self):
+        return self.capacity - (self.written - self.read)
+
+    def write(self, block):
+        n = len(block)
+        i = self.written % self.capacity
+        first = min(n, self.capacity - i)
+        self.data[i:i + first] = block[:first]
+        self.data[:n - first] = block[first:]
+        self.written += n
+
+    def read_into(self, outdata, frames):
+        # Kopiert so viel wie da ist, gibt die Anzahl kopierter Frames zurück
+        n = min(frames, self.available())
+        i = self.read % self.capacity
+        first = min(n, self.capacity - i)
+        outdata[:first] = self.data[i:i + first]
+        outdata[first:n] = self.data[:n - first]
+        self.read += n
+        return n
+
+
+# Klassen-Grenzen des Renderzeit-Histogramms in ms (letzte Klasse = alles darüber)
+RENDER_TIME_BINS_MS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0)
+
+
+class AudioMetrics:
+    """Laufzeit-Statistik des Live Playbacks.
+
+    Wird nur vom rendernden Thread geschrieben (Audio Callback bzw. Look-Ahead Thread),
+    die UI liest nur. load ist die Renderzeit im Verhältnis zur Blockdauer.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.blocks = 0
+        self.render_hist = np.zeros(len(RENDER_TIME_BINS_MS) + 1, dtype=np.int64)
+        self.render_time_total = 0.0
+        self.render_time_max = 0.0
+        self.load = 0.0
+        self.load_max = 0.0
+        self.underruns = 0
+        self.overruns = 0
+        self.voices = 0
+        self.voices_max = 0
+        self.exceptions = 0
+        self.last_error = None
+        # Live MIDI: Zeit vom Eintreffen eines Note On bis es aus dem Lautsprecher kommt
+        self.input_latencies = 0
+        self.input_latency = 0.0
+        self.input_latency_total = 0.0
+        self.input_latency_max = 0.0
+
+    def record(self, elapsed, frames, sample_rate, voices):
+        self.blocks += 1
+        self.render_hist[np.searchsorted(RENDER_TIME_BINS_MS, elapsed * 1000.0)] += 1
+        self.render_time_total += elapsed
+        self.render_time_max = max(self.render_time_max, elapsed)
+        load = elapsed * sample_rate / frames
+        # Gleitender Mittelwert für die Anzeige, Maximum für die Auswertung
+        self.load = load if self.blocks == 1 else 0.9 * self.load + 0.1 * load
+        self.load_max = max(self.load_max, load)
+        self.voices = voices
+        self.voices_max = max(self.voices_max, voices)
+
+    def record_status(self, status):
+        # sounddevice CallbackFlags
+        if status.output_underflow: self.underruns += 1
+        if status.output_overflow: self.overruns += 1
+
+    def record_input_latency(self, seconds):
+        self.input_latencies += 1
+        self.input_latency = seconds
+        self.input_latency_total += seconds
+        self.input_latency_max = max(self.input_latency_max, seconds)
+
+    def record_exception(self, exc):
+        self.exceptions += 1
+        self.last_error = f"{type(exc).__name__}: {exc}"
+
+    def as_dict(self):
+        labels = [f"<{b}ms" for b in RENDER_TIME_BINS_MS] + [f">={RENDER_TIME_BINS_MS[-1]}ms"]
+        return {
+            "blocks": self.blocks,
+            "render_time_hist": dict(zip(labels, self.render_hist.tolist())),
+            "render_time_mean_ms": 1000.0 * self.render_time_total / max(1, self.blocks),
+            "render_time_max_ms": 1000.0 * self.render_time_max,
+            "dsp_load_percent": 100.0 * self.load,
+            "dsp_load_max_percent": 100.0 * self.load_max,
+            "underruns": self.underruns,
+            "overruns": self.overruns,
+            "voices": self.voices,
+            "voices_max": self.voices_max,
+            "exceptions": self.exceptions,
+            "last_error": self.last_error,
+            "input_events": self.input_latencies,
+            "input_latency_ms": 1000.0 * self.input_latency,
+            "input_latency_mean_ms": 1000.0 * self.input_latency_total / max(1, self.input_latencies),
+            "input_latency_max_ms": 1000.0 * self.input_latency_max,
+        }
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+class ChannelMeters:
+    """Pegel und Aktivität pro Kanal für die Anzeige.
+
+    Der Audio Thread schreibt nach jedem Block in zwei feste Arrays (einziger Schreiber),
+    die UI liest sie in festem Takt. So kostet die Anzeige gleich viel, egal wie viele
+    Noten pro Sekunde gespielt werden.
+    """
+
+    def __init__(self, falloff=0.3):
+        self.falloff = falloff  # Sekunden, bis der Pegel auf 1/e gefallen ist
+        self.level = np.zeros(16)                # RMS pro Kanal, nach der Mix-Normalisierung
+        self.voices = np.zeros(16, dtype=np.int32)  # klingende Stimmen pro Kanal
+        self.energy = np.zeros(16)
+
+    def reset(self):
+        self.level[:] = 0.0
+        self.voices[:] = 0
+        self.energy[:] = 0.0
+
+    def measure(self, ch, gain, wave):
+        # RMS jeder Stimme im Block, pro Kanal als Energie aufsummiert
+        rms2 = np.einsum("ij,ij->i", wave, wave) * (gain * gain) / max(1, wave.shape[1])
+        self.energy[:] = np.bincount(ch, weights=rms2, minlength=16)
+
+    def publish(self, channels, frames, sample_rate, note_count):
+        self.voices[:] = np.bincount(channels, minlength=16)
+        level = np.sqrt(self.energy) / max(1, note_count) ** 0.55
+        self.level *= np.exp(-frames / (self.falloff * sample_rate))
+        np.maximum(self.level, level, out=self.level)
+        self.energy[:] = 0.0
+
+
+class DrumCache:
+    """LRU Cache für vorgerenderte Drum-Hits (One-Shots).
+
+    Schlüssel sind alle Parameter, von denen der Klang abhängt, deshalb ist ein Treffer
+    immer gültig. Begrenzt über den Speicher, die ältesten Hits fliegen zuerst raus.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.buffers = OrderedDict()
+        self.nbytes = 0
+
+    def get(self, key, render):
+        buf = self.buffers.get(key)
+        if buf is not None:
+            self.buffers.move_to_end(key)
+            return buf
+        buf = render()
+        self.buffers[key] = buf
+        self.nbytes += buf.nbytes
+        while self.nbytes > self.max_bytes and len(self.buffers) > 1:
+            _, old = self.buffers.popitem(last=False)
+            self.nbytes -= old.nbytes
+        return buf
+
+    def clear(self):
+        self.buffers.clear()
+        self.nbytes = 0
+
+
+# Oszillator-Modi: naive = harte Kanten wie ein echter Chip (mit Aliasing),
+# wavetable = band-limitierte Tabellen, sauber auch bei 22050/11025 Hz
+OSCILLATORS = ("naive", "wavetable")
+WAVETABLE_SIZE = 2048
+WAVETABLE_LEVELS = 11  # Stufe j hat 2**j Harmonische, die letzte bis WAVETABLE_SIZE / 2
+
+
+class WavetableBank:
+    """Band-limitierte Wellenformen als Mip-Map, pro Stufe doppelt so viele Harmonische.
+
+    Jede Wellenform ist ein flaches float32 Array aus WAVETABLE_LEVELS Tabellen mit je
+    einem Schutzsample (= erstes Sample) für die lineare Interpolation. Gebaut wird erst
+    beim ersten Gebrauch. Die Tabellen hängen nur von der Zahl der Harmonischen ab, die
+    Sample Rate bestimmt nur, welche Stufe eine Stimme liest (offsets).
+    Pulse braucht keine eigene Tabelle: Pulse(p, d) = (2d - 1) - (Saw(p) - Saw(p - d))
+    gilt für jede Pulsbreite, auch während der PW Automation.
+    """
+
+    def __init__(self):
+        self.tables = {}
+
+    def get(self, shape):
+        if shape not in self.tables:
+            self.tables[shape] = self.build(shape)
+        return self.tables[shape]
+
+    def build(self, shape):
+        n = WAVETABLE_SIZE
+        h = np.arange(1, n // 2 + 1)
+        # Spektrum für irfft: Sawtooth 2p - 1 = -2/pi * sum sin(2 pi h p) / h,
+        # Triangle 1 - 4|p - 0.5| = -8/pi^2 * sum cos(2 pi h p) / h^2 (nur ungerade h)
+        if shape == "saw":
+            coeff = 1j * (2.0 / np.pi) / h * (n / 2)
+        elif shape == "triangle":
+            coeff = np.where(h % 2 == 1, -8.0 / (np.pi ** 2 * h ** 2), 0.0) * (n / 2)
+        else:
+            raise ValueError(f"Unbekannte Wavetable: {shape}")
+
+        table = np.empty((WAVETABLE_LEVELS, n + 1), dtype=np.float32)
+        spectrum = np.zeros(n // 2 + 1, dtype=np.complex128)
+        for level in range(WAVETABLE_LEVELS):
+            spectrum[1:] = 0.0
+            harmonics = 2 ** level
+            spectrum[1:harmonics + 1] = coeff[:harmonics]
+            table[level, :n] = np.fft.irfft(spectrum, n)
+            table[level, n] = table[level, 0]
+        table.setflags(write=False)
+        return table.reshape(-1)
+
+    @staticmethod
+    def offsets(freq, sample_rate):
+        # Startindex der Stufe jeder Stimme: die meisten Harmonischen unter sample_rate / 2
+        level = np.floor(np.log2(sample_rate / (2.0 * freq)))
+        return np.clip(level, 0, WAVETABLE_LEVELS - 1).astype(np.int64) * (WAVETABLE_SIZE + 1)
+
+
+def wavetable_lookup(synth, table, offset, phase, out):
+    # out = Tabelle an phase (Stimmen x Frames, [0, 1)), linear interpoliert, jede Stimme
+    # in ihrer Mip-Stufe (offset). out darf phase sein
+    n, frames = phase.shape
+    pos = synth.block_buffer("wt_pos", n, frames)
+    frac = synth.block_buffer("wt_frac", n, frames)
+    index = synth.block_buffer("wt_index", n, frames, np.intp)
+    np.multiply(phase, WAVETABLE_SIZE, out=pos)
+    np.floor(pos, out=frac)
+    index[:] = frac
+    np.subtract(pos, frac, out=frac)
+    index += offset[:, None]
+    np.take(table, index, out=out, mode="clip")
+    index += 1
+    np.take(table, index, out=pos, mode="clip")
+    pos -= out
+    pos *= frac
+    out += pos
+
+
+class NumpyKernel:
+    """Referenz-Backend für die Melodiestimmen eines Blocks.
+
+    Ein NumPy Durchgang pro Rechenschritt (Phase, Wellenform, Pulsbreite, Envelope)
+    über alle Stimmen einer Gruppe. Jedes andere Backend muss dieselben Samples liefern.
+    """
+
+    def render_melody(self, synth, pool, rows, ch, start, params, edges, wave):
+        # rows sind nach Wellenform und Envelope gruppiert (siehe VOICE_GROUPS)
+        # Phase aus dem Akkumulator jeder Stimme (voice_phases), danach wird wave in-place
+        # zur Wellenform
+        frames = wave.shape[1]
+        synth.voice_phases(pool, rows, ch, start, frames, params, out=wave)
+
+        tables = params["wavetables"]
+        if tables is not None:
+            self.render_wavetables(synth, pool, rows, ch, start, params, edges, wave, tables)
+        else:
+            self.render_naive(synth, pool, rows, ch, start, params, edges, wave)
+
+        # Envelope anpassung, die Envelope-Stimmen liegen am Ende jeder Wellenform-Gruppe
+        spans = [(edges[i], edges[i + 1]) for i in (1, 3, 5) if edges[i + 1] > edges[i]]
+        if spans:
+            env_rows = np.concatenate([np.arange(a, b) for a, b in spans])
+            env = synth.render_envelopes(pool, rows[env_rows], ch[env_rows], params, frames)
+            i = 0
+            for a, b in spans:
+                wave[a:b] *= env[i:i + b - a]
+                i += b - a
+
+    def render_naive(self, synth, pool, rows, ch, start, params, edges, wave):
+        # Harte Kanten aus der Phase in wave, wie beim echten Chip
+        frames = wave.shape[1]
+        a, b = edges[0], edges[2]
+        if b > a:
+            # Pulse
+            pw = synth.pulse_widths(pool, rows[a:b], ch[a:b], start, frames, params)
+            w = wave[a:b]
+            np.less(w, pw, out=w)
+            w *= 2.0
+            w -= 1.0
+
+        a, b = edges[2], edges[4]
+        if b > a:
+            # Triangle
+            w = wave[a:b]
+            w -= 0.5
+            np.abs(w, out=w)
+            w *= -4.0
+            w += 1.0
+
+        a, b = edges[4], edges[6]
+        if b > a:
+            # Sawtooth
+            w = wave[a:b]
+            w -= 0.5
+            w *= 2.0
+
+    def render_wavetables(self, synth, pool, rows, ch, start, params, edges, wave, tables):
+        # Tabellen-Lookup mit linearer Interpolation aus der Phase in wave
+        frames = wave.shape[1]
+        offset = WavetableBank.offsets(synth.peak_freqs(pool, rows, ch, params), synth.sample_rate)
+        a, b = edges[0], edges[2]
+        if b > a:
+            # Pulse als Differenz zweier Sawtooth Lookups, um die Pulsbreite versetzt
+            pw = synth.pulse_widths(pool, rows[a:b], ch[a:b], start, frames, params)
+            w = wave[a:b]
+            shifted = synth.block_buffer("wt_shifted", b - a, frames)
+            np.subtract(w, pw, out=shifted)
+            np.remainder(shifted, 1.0, out=shifted)
+            wavetable_lookup(synth, tables["saw"], offset[a:b], w, w)
+            wavetable_lookup(synth, tables["saw"], offset[a:b], shifted, shifted)
+            w -= shifted
+            # (2 pw - 1) - w, im Puffer von shifted (ohne Temporäre in Blockgröße)
+            np.multiply(pw, 2.0, out=shifted)
+            shifted -= 1.0
+            np.subtract(shifted, w, out=w)
+
+        a, b = edges[2], edges[4]
+        if b > a:
+            wavetable_lookup(synth, tables["triangle"], offset[a:b], wave[a:b], wave[a:b])
+
+        a, b = edges[4], edges[6]
+        if b > a:
+            wavetable_lookup(synth, tables["saw"], offset[a:b], wave[a:b], wave[a:b])
+
+
+def wavetable_sample(table, offset, p):
+    # Ein Sample wie wavetable_lookup
+    pos = p * np.float32(WAVETABLE_SIZE)
+    whole = np.floor(pos)
+    frac = pos - whole
+    i = offset + int(whole)
+    return (table[i + 1] - table[i]) * frac + table[i]
+
+
+def fused_melody(wave, shape, pw_mode, pw, env_on, env, saw, triangle, offset):
+    # Alle Melodiestimmen in einer Schleife pro Stimme und Sample, mit denselben float32
+    # Operationen in derselben Reihenfolge wie NumpyKernel. wave enthält beim Aufruf die
+    # Phase (voice_phases) und wird in-place zur Wellenform.
+    # shape: 0 Pulse, 1 Triangle, 2 Sawtooth. pw_mode: 0 fest (pw[0]), 1 Bounce,
+    # 2 linear, pw = (Rate bzw. Schritt, Offset, Range, Start) pro Stimme.
+    # env = Koeffizienten aus envelope_coefficients, gilt nur wo env_on.
+    # saw/triangle: Wavetables (leer = naive Wellenformen), offset = Mip-Stufe pro Stimme
+    rows, frames = wave.shape
+    tables = saw.size > 0
+    zero = np.float32(0.0)
+    one = np.float32(1.0)
+    half = np.float32(0.5)
+    two = np.float32(2.0)
+    for i in range(rows):
+        duration = one
+        if pw_mode[i] == 2:
+            # Linearer Verlauf wird auf die Zeit am Blockende normiert (wie note_t[:, -1:])
+            duration = max(np.float32(0.001), max(pw[0, i] * np.float32(frames - 1) + pw[1, i], zero))
+        for k in range(frames):
+            kf = np.float32(k)
+            p = wave[i, k]
+            if shape[i] == 0:
+                if pw_mode[i] == 1:
+                    c = (pw[0, i] * kf + pw[1, i]) % two
+                    width = (one - abs(c - one)) * pw[2, i] + pw[3, i]
+                elif pw_mode[i] == 2:
+                    t = max(pw[0, i] * kf + pw[1, i], zero) / duration
+                    width = min(max(t, zero), one) * pw[2, i] + pw[3, i]
+                else:
+                    width = pw[0, i]
+                if tables:
+                    shifted = (p - width) % one
+                    w = (width * two - one) - (wavetable_sample(saw, offset[i], p) -
+                                               wavetable_sample(saw, offset[i], shifted))
+                else:
+                    w = one if p < width else -one
+            elif tables:
+                w = wavetable_sample(triangle if shape[i] == 1 else saw, offset[i], p)
+            elif shape[i] == 1:
+                w = abs(p - half) * np.float32(-4.0) + one
+            else:
+                w = (p - half) * two
+            if env_on[i]:
+                k1 = np.float32(k + 1)
+                w *= min(env[1, i] * k1 + env[0, i], max(env[2, i] - env[3, i] * k1, env[4, i]))
+            wave[i, k] = w
+
+
+class FusedKernel(NumpyKernel):
+    """Backend mit einer Schleife pro Stimme über den ganzen Block (fused_melody).
+
+    Pro Block werden nur die Koeffizienten jeder Stimme vorbereitet, die Samples
+    entstehen in einem Durchgang ohne Zwischenpuffer. Gedacht für numba, ohne JIT
+    läuft es (sehr langsam) als Python Schleife. melody ersetzt fused_melody, z.B.
+    durch die nicht kompilierte Fassung.
+    """
+
+    def __init__(self, melody=None):
+        self.melody = melody
+
+    def render_melody(self, synth, pool, rows, ch, start, params, edges, wave):
+        n, frames = wave.shape
+        sr = synth.sample_rate
+        synth.voice_phases(pool, rows, ch, start, frames, params, out=wave)
+        # Gruppen wie VOICE_GROUPS: Pulse, Triangle, Sawtooth, Envelope jeweils am Ende
+        index = np.arange(n)
+        shape = np.searchsorted(edges[[2, 4]], index, side="right").astype(np.int8)
+        env_on = np.zeros(n, dtype=np.bool_)
+        for i in (1, 3, 5):
+            env_on[edges[i]:edges[i + 1]] = True
+
+        pw = np.zeros((4, n), dtype=np.float32)
+        pw[0] = params["pulse_width32"][ch]
+        pw_mode = np.zeros(n, dtype=np.int8)
+        auto = params["pw_enabled"][ch] & (shape == 0)
+        if auto.any():
+            bounce = auto & params["pw_bounce"][ch]
+            linear = auto & ~bounce
+            rate = params["pw_bounce_rate"][ch[bounce]]
+            pw_mode[bounce] = 1
+            pw[0, bounce] = rate.astype(np.float32)
+            pw[1, bounce] = ((start * rate) % 2.0).astype(np.float32)
+            pw_mode[linear] = 2
+            pw[0, linear] = np.float32(1.0 / sr)
+            pw[1, linear] = ((start - pool.start[rows[linear]]) / sr).astype(np.float32)
+            pw[2, auto] = params["pw_range32"][ch[auto]]
+            pw[3, auto] = params["pw_start32"][ch[auto]]
+
+        env = np.zeros((5, n), dtype=np.float32)
+        if env_on.any():
+            env[:, env_on] = synth.envelope_coefficients(pool, rows[env_on], ch[env_on], params, frames)[0]
+
+        tables = params["wavetables"]
+        if tables is not None:
+            saw, triangle = tables["saw"], tables["triangle"]
+            offset = WavetableBank.offsets(synth.peak_freqs(pool, rows, ch, params), sr)
+        else:
+            saw = triangle = np.zeros(0, dtype=np.float32)
+            offset = np.zeros(n, dtype=np.int64)
+        (self.melody or fused_melody)(wave, shape, pw_mode, pw, env_on, env, saw, triangle, offset)
+
+
+# Synthese-Backends, die Einstellung "kernel" wählt eins. numba wird automatisch genommen,
+# wenn es installiert ist
+KERNELS = {"numpy": NumpyKernel()}
+if numba is not None:
+    wavetable_sample = numba.njit(cache=True, nogil=True)(wavetable_sample)
+    fused_melody = numba.njit(cache=True, nogil=True)(fused_melody)
+    KERNELS["numba"] = FusedKernel()
+DEFAULT_KERNEL = "numba" if "numba" in KERNELS else "numpy"
+# Nur für die Äquivalenzprüfung im Benchmark: fused_melody als reines Python, so wird die
+# Schleife auch ohne numba gegen NumPy geprüft (zum Spielen viel zu langsam)
+REFERENCE_KERNELS = {"fused": FusedKernel(getattr(fused_melody, "py_func", fused_melody))}
+
 
 class RetroSynth:
     def __init__(self):
         self.sample_rate = 44100
         self.max_polyphony = 16 # Mehr Stimmen für Sicherheit
-        self.active_notes = {} 
+        self.voices = VoicePool(self.max_polyphony)
         self.lock = threading.Lock()
+
+        # Live Playback: Events mit Ziel-Sample, Blockgröße des Audio Streams (0 = Treiber wählt)
+        self.events = EventQueue()
+        self.block_size = 1024
+        # Look-Ahead: > 0 = ein Thread rendert so viele ms voraus, der Callback kopiert nur
+        self.latency_ms = 0
+        self.ahead = None
+        # Statistik des Live Playbacks, wird beim Stoppen nach metrics_path geschrieben (falls gesetzt)
+        self.metrics = AudioMetrics()
+        self.metrics_path = None
+        self.dac_clock = None  # (Stream-Zeit, Sample) des zuletzt ausgegebenen Blocks
+        # float32 Arbeitspuffer der Synthese, einmal angelegt und pro Block wiederverwendet
+        self.buffers = {}
+        self.steps = np.arange(1, dtype=np.float32)
         
         # --- GLOBAL ---
         self.drum_channel = 9 
         self.bit_depth = 16.0 
-        self.note_activity_callback = None  # Für das visuelle Feedback
+        self.kernel = DEFAULT_KERNEL  # Synthese-Backend aus KERNELS
+        self.oscillator = "naive"  # siehe OSCILLATORS
+        self.wavetables = WavetableBank()
+        self.meters = None  # ChannelMeters für das visuelle Feedback (nur mit UI)
+
+        # --- SETTINGS ---
+        self.kick_vol = 1.0
+        self.kick_decay = 0.15 
+        self.kick_type = "Triangle" 
+        self.kick_noise_period = 0  # Index in NES_NOISE_PERIODS, 0 = hellstes Rauschen
+
+        self.snare_vol = 0.8
+        self.snare_decay = 0.2 
+        self.snare_body = 0.5  
+        self.snare_type = "White Noise"
+        self.snare_noise_period = 0
+        self.drum_cache = DrumCache()
+
+        # --- MELODY ---
+        self.channel_settings = {
+            ch: {
+                "volume": 0.5,
+                "waveform": "Pulse",
+                "pulse_width": 0.25,
+
+                # Extra erweiterte modi weil cool
+                "pan": 0.0, # -1 = links, 0 = mitte, +1 = rechts
+
+                "env_enabled": False,
+                "attack": 0.01,
+                "decay": 0.1,
+                "sustain": 0.7,
+                "release": 0.2,
+
+                "pw_enabled": False,
+                "pw_start": 0.25,
+                "pw_stop": 0.5,
+                "pw_bounce": False,
+                "pw_bounce_time": 0.2,
+
+                # Vibrato: Tiefe in Halbtönen (0 = aus), Rate in Hz, ab Notenbeginn
+                "vibrato_depth": 0.0,
+                "vibrato_rate": 5.0,
+            }
+            for ch in range(16)
+        }
+
+        self.current_sample_index = 0
+        self.stream = None
+        self.bend = np.zeros(16)  # Pitch Bend pro Kanal in Halbtönen (Spielzustand, kein Setting)
+
+        # Vorberechneter Patch für den Renderer, wird bei jeder Änderung neu gebaut und getauscht
+        self.patch = self.channel_params()
+        self.applied_gains = None  # Gain-Tabelle des letzten Blocks (Volume/Pan Gleiten)
+
+    def get_freq(self, midi_note):
+        return 440.0 * (2.0 ** ((midi_note - 69) / 12.0))
+
+    def reset_state(self):
+        with self.lock:
+            if self.voices.capacity != self.max_polyphony:
+                self.voices = VoicePool(self.max_polyphony)
+            self.voices.clear()
+            self.events.clear()
+            self.current_sample_index = 0
+            self.bend[:] = 0.0
+            self.publish_patch()
+            self.applied_gains = None
+            if self.meters is not None:
+                self.meters.reset()
+
+    def channel_params(self, mono=False):
+        # Patch: alle Kanaleinstellungen als Arrays (Index = Kanal) plus die daraus abgeleiteten
+        # Werte (Pan-Gains, Envelope-Schritte pro Sample, PW Koeffizienten, Gain-Tabelle).
+        # Wird nur beim Ändern einer Einstellung gebaut und danach nur gelesen.
+        # mono = ohne Panorama (Stems, Pan kommt erst beim Mischen dazu)
+        cs = [self.channel_settings[ch] for ch in range(16)]
+        table = np.array([[c[key] for key in CHANNEL_NUMERIC] for c in cs], dtype=np.float64)
+        params = {key: table[:, i] for i, key in enumerate(CHANNEL_NUMERIC)}
+        sr = self.sample_rate
+
+        for key in ("env_enabled", "pw_enabled", "pw_bounce"):
+            params[key] = params[key] != 0
+        pan = params["pan"]
+        params["pan_left"] = np.ones(16) if mono else np.cos((pan + 1) * np.pi/4)
+        params["pan_right"] = np.ones(16) if mono else np.sin((pan + 1) * np.pi/4)
+        # Unbekannte Wellenform klingt wie bisher als Sawtooth
+        params["waveform"] = np.array([WAVEFORMS.index(c["waveform"]) if c["waveform"] in WAVEFORMS else 2 for c in cs])
+
+        # Envelope: Schritte pro Sample (Release wird noch mit dem Startpegel multipliziert)
+        params["attack_step"] = 1.0 / (np.maximum(0.001, params["attack"]) * sr)
+        params["decay_step"] = (1.0 - params["sustain"]) / (np.maximum(0.001, params["decay"]) * sr)
+        params["release_step"] = 1.0 / (np.maximum(0.001, params["release"]) * sr)
+        params["sustain32"] = params["sustain"].astype(np.float32)
+
+        # Pulsbreite und PW Automation (Rampe ab pw_start um pw_range, Bounce in Perioden pro Sample)
+        params["pulse_width32"] = params["pulse_width"].astype(np.float32)
+        params["pw_start32"] = params["pw_start"].astype(np.float32)
+        params["pw_range32"] = (params["pw_stop"] - params["pw_start"]).astype(np.float32)
+        params["pw_bounce_rate"] = 1.0 / (np.maximum(0.001, params["pw_bounce_time"]) * sr)
+
+        # Verstärkung pro (Art, Kanal, Seite): Melodie mit Kanal-Volume, Drums mit Kick/Snare Volume
+        level = np.empty((3, 16))
+        level[KIND_MELODY] = params["volume"]
+        level[KIND_KICK] = self.kick_vol * 2.0
+        level[KIND_SNARE] = self.snare_vol
+        params["mix_gains"] = level[:, :, None] * np.stack([params["pan_left"], params["pan_right"]], axis=1)
+        params["sample_rate"] = sr
+        # Nicht installiertes Backend (z.B. numba in einem geteilten Settings File): NumPy Referenz
+        params["kernel"] = KERNELS.get(self.kernel) or REFERENCE_KERNELS.get(self.kernel, KERNELS["numpy"])
+
+        # Band-limitierte Tabellen, erst gebaut, wenn der Wavetable Modus benutzt wird
+        if self.oscillator not in OSCILLATORS:
+            raise ValueError(f"Unbekannter Oszillator: {self.oscillator}")
+        params["wavetables"] = None
+        if self.oscillator == "wavetable":
+            params["wavetables"] = {shape: self.wavetables.get(shape) for shape in ("saw", "triangle")}
+
+        for value in params.values():
+            if isinstance(value, np.ndarray):
+                value.setflags(write=False)
+        return params
+
+    def publish_patch(self):
+        # Neuen Patch bauen und mit einer Zuweisung tauschen, der Audio Thread liest pro
+        # Block einmal self.patch und sieht so nie einen halb geänderten Stand
+        self.patch = self.channel_params()
+        return self.patch
+
+    def set_channel(self, ch, key, value):
+        # Kanaleinstellung ändern (z.B. aus dem UI Thread), gilt ab dem nächsten Block
+        self.channel_settings[ch][key] = value
+        self.publish_patch()
+
+    def set_param(self, name, value):
+        # Globale Einstellung wie kick_vol ändern, gilt ab dem nächsten Block
+        setattr(self, name, value)
+        self.publish_patch()
+
+    def glide_gains(self, old, target, frames):
+        # Gain-Tabelle nach frames Samples exponentiellem Gleiten von old Richtung target
+        if old is None or old is target:
+            return target
+        gains = target + (old - target) * np.exp(-frames / (PARAM_SMOOTHING * self.sample_rate))
+        if np.abs(gains - target).max() < SILENCE_LEVEL:
+            return target
+        return gains
+
+    def block_buffer(self, name, rows, frames, dtype=np.float32):
+        # Wiederverwendbarer Arbeitspuffer (rows x frames, float32 sofern nicht anders angegeben)
+        # als zusammenhängende View auf einen flachen Speicherblock. Er wächst nur, wenn ein
+        # Block mehr Platz braucht als alle bisherigen
+        buf = self.buffers.get(name)
+        size = rows * frames
+        if buf is None or len(buf) < size:
+            buf = np.empty(max(size, 2 * len(buf) if buf is not None else 0), dtype=dtype)
+            self.buffers[name] = buf
+        return buf[:size].reshape(rows, frames)
+
+    def frame_steps(self, frames):
+        # 0, 1, ..., frames als float32 (Rampen innerhalb eines Blocks)
+        if len(self.steps) <= frames:
+            self.steps = np.arange(max(frames + 1, 2 * len(self.steps)), dtype=np.float32)
+        return self.steps[:frames + 1]
+
+    def generate_chunk(self, frames, current_time_index, out=None):
+        # Rendert frames Samples nach out (frames, 2), z.B. direkt in outdata von sounddevice,
+        # und liefert (links, rechts) als Views darauf. Ohne out wird ein Puffer angelegt.
+        if frames <= 0: return np.array([]), np.array([])
+        if out is None:
+            out = np.empty((frames, 2), dtype=np.float32)
+
+        # Verstummt eine Stimme mitten im Chunk, dort teilen, damit sie genau ab da nicht mehr
+        # in die Normalisierung zählt (wie beim Span-Renderer)
+        split = self.next_retirement(current_time_index, frames)
+        if split < frames:
+            self.generate_chunk(split, current_time_index, out[:split])
+            self.generate_chunk(frames - split, current_time_index + split, out[split:])
+            return out[:, 0], out[:, 1]
+
+        # Patch einmal pro Block lesen, Änderungen aus dem UI kommen als neuer Patch
+        params = self.patch
+        if params["sample_rate"] != self.sample_rate:
+            params = self.publish_patch()
+
+        meters = self.meters
+        with self.lock:
+            pool = self.voices
+            rows = np.flatnonzero(pool.active)
+
+            # WICHTIG: Note Count merken für Normalisierung
+            note_count = len(rows)
+
+            # Volume/Pan gleiten von den zuletzt benutzten Gains zum neuen Patch
+            gains_from = self.applied_gains
+            if gains_from is None or gains_from is params["mix_gains"]:
+                gains_from = None
+            if note_count > 0:
+                mix = self.render_voices(pool, rows, current_time_index, frames, params, meters, gains_from)
+                self.retire_voices(pool, rows, current_time_index + frames)
+            self.applied_gains = self.glide_gains(gains_from, params["mix_gains"], frames)
+            if meters is not None:
+                meters.publish(pool.channel[pool.active], frames, self.sample_rate, note_count)
+
+        if note_count == 0:
+            out[:] = 0.0
+            return out[:, 0], out[:, 1]
+
+        # Normalisierung
+        mix /= note_count ** 0.55
+
+        # Bitcrusher
+        if self.bit_depth < 128:
+            mix *= self.bit_depth
+            np.round(mix, out=mix)
+            mix /= self.bit_depth
+
+        out[:] = mix.T
+        return out[:, 0], out[:, 1]
+
+    def advance_chunk(self, frames, current_time_index):
+        # Wie generate_chunk, nur ohne Audio: Envelopes, Drums und Voice Pool laufen genau so
+        # weiter (gleiche Teilung, gleiche float32 Rechnung), damit ein Segment-Export ab
+        # einem Songpunkt denselben Zustand hat wie ein Export von Anfang an
+        split = self.next_retirement(current_time_index, frames)
+        if split < frames:
+            self.advance_chunk(split, current_time_index)
+            self.advance_chunk(frames - split, current_time_index + split)
+            return
+
+        params = self.patch
+        if params["sample_rate"] != self.sample_rate:
+            params = self.publish_patch()
+
+        with self.lock:
+            pool = self.voices
+            rows = np.flatnonzero(pool.active)
+            gains_from = self.applied_gains
+            if gains_from is None or gains_from is params["mix_gains"]:
+                gains_from = None
+            if rows.size:
+                ch = pool.channel[rows]
+                melody = pool.kind[rows] == KIND_MELODY
+                if melody.any():
+                    self.voice_phases(pool, rows[melody], ch[melody], current_time_index, frames, params)
+                env = melody & params["env_enabled"][ch]
+                if env.any():
+                    self.render_envelopes(pool, rows[env], ch[env], params, frames, state_only=True)
+                self.retire_voices(pool, rows, current_time_index + frames)
+            self.applied_gains = self.glide_gains(gains_from, params["mix_gains"], frames)
+
+    def drum_ends(self, pool, rows):
+        # Sample, ab dem jede Drum aus rows unter SILENCE_LEVEL ist
+        kind = pool.kind[rows]
+        return pool.start[rows] + np.where(kind == KIND_KICK, self.drum_length(KIND_KICK), self.drum_length(KIND_SNARE))
+
+    def next_retirement(self, start, frames):
+        # Offset der ersten Stimme, die innerhalb von (start, start + frames) verstummt (Drum
+        # unter SILENCE_LEVEL oder Envelope ausgeklungen), sonst frames
+        params = self.patch
+        with self.lock:
+            pool = self.voices
+            rows = np.flatnonzero(pool.active)
+            if rows.size == 0:
+                return frames
+            drums = pool.kind[rows] != KIND_MELODY
+            ends = self.drum_ends(pool, rows[drums]) - start
+            ch = pool.channel[rows]
+            env = ~drums & params["env_enabled"][ch]
+            if env.any():
+                ends = np.concatenate([ends, self.envelope_ends(pool, rows[env], ch[env], params)])
+        ends = ends[(ends > 0) & (ends < frames)]
+        return int(ends.min()) if ends.size else frames
+
+    def retire_voices(self, pool, rows, now):
+        # Unhörbare Stimmen freigeben: Envelope ausgeklungen (ENV_OFF) oder Drum unter SILENCE_LEVEL
+        done = pool.env_phase[rows] == ENV_OFF
+        drums = pool.kind[rows] != KIND_MELODY
+        if drums.any():
+            done[drums] |= now >= self.drum_ends(pool, rows[drums])
+        pool.active[rows[done]] = False
+
+    def voice_loudness(self, pool):
+        # Grobe Lautstärke jeder Stimme für das Voice Stealing. Stimmen im Attack zählen
+        # als voll laut, damit gerade angeschlagene Noten nicht sofort wieder verschwinden
+        level = pool.vel.copy()
+        env = self.patch["env_enabled"][pool.channel]
+        env &= (pool.kind == KIND_MELODY) & (pool.env_phase != ENV_ATTACK)
+        level[env] *= pool.env_level[env]
+        drums = pool.kind != KIND_MELODY
+        if drums.any():
+            age = (self.current_sample_index - pool.start[drums]) / self.sample_rate
+            decay = np.where(pool.kind[drums] == KIND_KICK, max(0.01, self.kick_decay), max(0.01, self.snare_decay))
+            level[drums] *= np.exp(-np.maximum(age, 0.0) / decay)
+        return level
+
+    def render_voices(self, pool, rows, start, frames, params, meters=None, gains_from=None):
+        # Alle Stimmen aus rows auf einmal als (Stimmen x Frames) Matrix ab Sample start. Die
+        # Stimmen werden nach (Art, Wellenform, Envelope) sortiert, so ist jede Gruppe ein
+        # zusammenhängender Block, der in-place berechnet wird. Am Ende eine Summe -> (2, frames)
+        # in einem wiederverwendeten float32 Puffer. gains_from = Gain-Tabelle des letzten
+        # Blocks, geänderte Gains gleiten dann über PARAM_SMOOTHING zum Patch
+        ch = pool.channel[rows]
+        kind = pool.kind[rows]
+        group = np.where(kind == KIND_MELODY, params["waveform"][ch] * 2 + params["env_enabled"][ch], 8 * kind)
+        order = np.argsort(group, kind="stable")
+        rows, ch, kind, group = rows[order], ch[order], kind[order], group[order]
+        edges = np.searchsorted(group, VOICE_GROUPS)
+
+        wave = self.block_buffer("wave", len(rows), frames)
+
+        melody = edges[6]
+        if melody:
+            params["kernel"].render_melody(self, pool, rows[:melody], ch[:melody], start, params, edges[:7],
+                                           wave[:melody])
+
+        a, b = edges[7], edges[10]
+        if b > a:
+            self.render_drums(pool, rows[a:b], start, wave[a:b])
+
+        # Lautstärke und Seitenabgleich aus der Gain-Tabelle des Patches
+        vel = pool.vel[rows]
+        target = params["mix_gains"][kind, ch]
+        if meters is not None:
+            meters.measure(ch, vel * np.hypot(target[:, 0], target[:, 1]), wave)
+        gains = np.empty((2, len(rows)), dtype=np.float32)
+        np.multiply(vel, target[:, 0], out=gains[0])
+        np.multiply(vel, target[:, 1], out=gains[1])
+        mix = np.matmul(gains, wave, out=self.block_buffer("mix", 2, frames))
+
+        if gains_from is not None:
+            # Gain(k) = neu + (alt - neu) * d^k, die Korrektur ist eine Summe über die
+            # geänderten Stimmen mal derselben Kurve d^k. Unveränderte Stimmen haben Offset 0,
+            # so bleibt es ein matmul über die ganze Matrix ohne Kopie der bewegten Zeilen
+            delta = gains_from[kind, ch] - target
+            if delta.any():
+                curve = self.block_buffer("glide", 1, frames)[0]
+                np.multiply(self.frame_steps(frames)[1:], np.float32(-1.0 / (PARAM_SMOOTHING * self.sample_rate)),
+                            out=curve)
+                np.exp(curve, out=curve)
+                offset = (delta * vel[:, None]).T.astype(np.float32)
+                glide = np.matmul(offset, wave, out=self.block_buffer("glide_mix", 2, frames))
+                glide *= curve
+                mix += glide
+        return mix
+
+    def render_drums(self, pool, rows, block_start, wave):
+        # Drums sind One-Shots aus dem Cache, pro Stimme nur noch Slice und Kopie
+        frames = wave.shape[1]
+        wave[:] = 0
+        for i, slot in enumerate(rows):
+            buf = self.drum_oneshot(int(pool.kind[slot]), int(pool.note[slot]))
+            offset = block_start - int(pool.start[slot])
+            lo = max(0, -offset)
+            hi = min(frames, len(buf) - offset)
+            if hi > lo:
+                wave[i, lo:hi] = buf[offset + lo:offset + hi]
+
+    def drum_oneshot(self, kind, note):
+        if kind == KIND_KICK:
+            key = (kind, self.kick_type, self.kick_decay, None, self.kick_noise_period, note, self.sample_rate)
+            return self.drum_cache.get(key, lambda: self.render_kick(note).astype(np.float32))
+        key = (kind, self.snare_type, self.snare_decay, self.snare_body, self.snare_noise_period, note,
+               self.sample_rate)
+        return self.drum_cache.get(key, lambda: self.render_snare(note).astype(np.float32))
+
+    def render_kick(self, note):
+        # Ein kompletter Kick ohne Lautstärke, bis er unter SILENCE_LEVEL ausgeklungen ist
+        note_t = np.arange(self.drum_length(KIND_KICK)) / self.sample_rate
+        freq = self.get_freq(note)
+        env = np.exp(-note_t * (1.0 / max(0.01, self.kick_decay)))
+
+        if self.kick_type == "Triangle":
+            phase = (note_t * freq) % 1.0
+            raw = 2.0 * np.abs(2.0 * (phase - np.floor(phase + 0.5))) - 1.0
+        elif self.kick_type == "Sine":
+            raw = np.sin(2 * np.pi * freq * note_t)
+        elif self.kick_type == "Pulse":
+            raw = np.sign(np.sin(2 * np.pi * freq * note_t))
+        elif self.kick_type == "Noise":
+            raw = lfsr_noise(len(note_t), self.sample_rate, self.kick_noise_period)
+        else:
+            raw = np.zeros(note_t.shape)
+        return raw * env
+
+    def render_snare(self, note):
+        note_t = np.arange(self.drum_length(KIND_SNARE)) / self.sample_rate
+        freq = self.get_freq(note)
+        env_noise = np.exp(-note_t * (1.0 / max(0.01, self.snare_decay)))
+
+        # Rauschen kommt aus dem LFSR, White Noise mit dem Pegel (RMS) des alten Gleichverteilungs-Rauschens
+        if self.snare_type == "White Noise":
+            noise = lfsr_noise(len(note_t), self.sample_rate, self.snare_noise_period) * (1.0 / np.sqrt(3.0))
+        elif self.snare_type == "Digital":
+            noise = lfsr_noise(len(note_t), self.sample_rate, self.snare_noise_period)
+        else: 
+            mod = np.sin(2 * np.pi * (freq * 4.5) * note_t)
+            noise = lfsr_noise(len(note_t), self.sample_rate, self.snare_noise_period, short=True) * mod
+
+        noise_part = noise * env_noise
+
+        # Body/Punch
+        body_freq = 180.0 
+        env_body = np.exp(-note_t * 15.0) 
+        body_part = np.sin(2 * np.pi * body_freq * note_t) * env_body
+
+        return (noise_part * (1.0 - (self.snare_body * 0.4))) + (body_part * (self.snare_body * 2.0))
+
+    def voice_phases(self, pool, rows, ch, start, frames, params, out=None):
+        # Oszillatorphase der Melodiestimmen rows vor jedem Sample des Blocks nach out
+        # (float32, [0, 1)). Jede Stimme hat einen Phasenakkumulator (float64), der danach
+        # auf dem Blockende steht, so bleibt die Phase auch nach Stunden genau und ändert
+        # sich bei Pitch Bend oder Vibrato stetig. Ohne out wird nur weitergeschaltet
+        sr = self.sample_rate
+        inc = pool.freq[rows] / sr
+        bend = self.bend[ch]
+        if bend.any():
+            inc = inc * np.exp2(bend / 12.0)
+        phase0 = pool.phase[rows]
+        total = inc * frames
+        steps = self.frame_steps(frames)[:frames]
+        if out is not None:
+            np.multiply.outer(inc.astype(np.float32), steps, out=out)
+            out += phase0.astype(np.float32)[:, None]
+
+        depth = params["vibrato_depth"][ch]
+        if depth.any():
+            # Vibrato: Schrittweite pro Sample = inc * 2^(Tiefe * sin(LFO) / 12). Aufsummiert
+            # wird nur die Abweichung von inc (klein, bleibt in float32 genau), die Phase ist
+            # die Rampe oben plus die Summe der Abweichungen davor. Der LFO beginnt mit der Note.
+            # Gerechnet wird für alle Stimmen (ohne Vibrato ist die Abweichung 0), so geht die
+            # Summe in-place auf out statt über eine Kopie der Vibrato-Zeilen
+            rate = params["vibrato_rate"][ch]
+            dev = self.block_buffer("vibrato", len(rows), frames)
+            np.multiply.outer((rate / sr).astype(np.float32), steps, out=dev)
+            dev += ((start - pool.start[rows]) / sr * rate % 1.0).astype(np.float32)[:, None]
+            dev *= np.float32(2 * np.pi)
+            np.sin(dev, out=dev)
+            dev *= (depth / 12.0 * np.log(2.0)).astype(np.float32)[:, None]
+            np.expm1(dev, out=dev)
+            dev *= inc.astype(np.float32)[:, None]
+            np.cumsum(dev, axis=1, out=dev)
+            total += dev[:, -1]
+            if out is not None:
+                out[:, 1:] += dev[:, :-1]
+
+        if out is not None:
+            np.remainder(out, 1.0, out=out)
+        pool.phase[rows] = np.remainder(phase0 + total, 1.0)
+
+    def peak_freqs(self, pool, rows, ch, params):
+        # Höchste momentane Frequenz der Melodiestimmen rows im Block: Grundton mit Pitch Bend
+        # (im Block konstant) und voller Vibrato-Tiefe nach oben, z.B. für die Mip-Stufe
+        return pool.freq[rows] * np.exp2((self.bend[ch] + params["vibrato_depth"][ch]) / 12.0)
+
+    def pulse_widths(self, pool, rows, ch, start, frames, params):
+        # Pulsbreite pro Stimme, (n, 1) ohne Automation, sonst (n, frames)
+        pw = params["pulse_width32"][ch][:, None]
+        auto = params["pw_enabled"][ch]
+        if not auto.any():
+            return pw
+
+        out = self.block_buffer("pw", len(rows), frames)
+        out[:] = pw
+        pw_start = params["pw_start32"][ch][:, None]
+        pw_range = params["pw_range32"][ch][:, None]
+        sr = self.sample_rate
+        steps = self.frame_steps(frames)
+
+        bounce = np.flatnonzero(auto & params["pw_bounce"][ch])
+        if bounce.size:
+            # Zwichen start und stop über zeit welchseln
+            rate = params["pw_bounce_rate"][ch[bounce]]
+            cycle = self.block_buffer("pw_cycle", bounce.size, frames)
+            np.multiply.outer(rate.astype(np.float32), steps[:frames], out=cycle)
+            cycle += ((start * rate) % 2.0).astype(np.float32)[:, None]
+            np.remainder(cycle, 2.0, out=cycle)
+            # Dreieck: 0 -> 1 -> 0
+            cycle -= 1.0
+            np.abs(cycle, out=cycle)
+            np.subtract(1.0, cycle, out=cycle)
+            cycle *= pw_range[bounce]
+            cycle += pw_start[bounce]
+            out[bounce] = cycle
+
+        linear = np.flatnonzero(auto & ~params["pw_bounce"][ch])
+        if linear.size:
+            # Linearverlauf über die Zeit seit Notenbeginn (negativ = Note startet mitten im Block)
+            note_t = self.block_buffer("pw_cycle", linear.size, frames)
+            np.multiply.outer(np.full(linear.size, 1.0 / sr, dtype=np.float32), steps[:frames], out=note_t)
+            note_t += ((start - pool.start[rows[linear]]) / sr).astype(np.float32)[:, None]
+            np.maximum(note_t, 0.0, out=note_t)
+            note_duration = np.maximum(0.001, note_t[:, -1:])  # division durch 0 verhindern
+            note_t /= note_duration
+            np.clip(note_t, 0.0, 1.0, out=note_t)
+            note_t *= pw_range[linear]
+            note_t += pw_start[linear]
+            out[linear] = note_t
+
+        return out
+
+    def envelope_ramps(self, pool, rows, ch, params):
+        # ADSR in geschlossener Form für alle Stimmen gleichzeitig. Jede Stimme ist pro
+        # Block höchstens eine steigende Rampe (Attack) gefolgt von einer fallenden Rampe
+        # mit Untergrenze (Decay -> Sustain, Release -> 0):
+        #     env(k) = min(up0 + up * k, max(down0 - down * k, floor)),  k = 1 .. frames
+        # Liefert die Koeffizienten als float32 (5, Stimmen), die Maske der konstanten
+        # Stimmen (Sustain oder fertig: down0 = floor = Pegel, up0 = inf) und die Schritte
+        # bis zum Ende des Attacks. Ändert den Pool nicht
+        phase = pool.env_phase[rows]
+        s = params["sustain32"][ch]
+        level = pool.env_level[rows]
+        step_a = params["attack_step"][ch]
+        step_d = params["decay_step"][ch]
+        step_r = pool.release_level[rows] * params["release_step"][ch]
+
+        steady = (phase == ENV_SUSTAIN) | (phase == ENV_OFF)
+        attack = phase == ENV_ATTACK
+        release = phase == ENV_RELEASE
+        hold = np.where(phase == ENV_OFF, 0.0, s)
+
+        # Schritte bis Attack 1.0 erreicht (mind. einer, wie in der Sample-Schleife)
+        n_a = np.where(attack, np.maximum(1, np.ceil((1.0 - level) / step_a)), 0)
+
+        coeff = np.empty((5, len(rows)), dtype=np.float32)
+        up0, up, down0, down, floor = coeff
+        up0[:] = np.where(attack, level, np.inf)
+        up[:] = np.where(attack, step_a, 0.0)
+        down0[:] = np.where(attack, 1.0 + step_d * n_a, level)
+        down[:] = np.where(release, step_r, step_d)
+        floor[:] = np.where(release, 0.0, s)
+        up0[steady] = np.inf
+        up[steady] = down[steady] = 0.0
+        down0[steady] = floor[steady] = hold[steady]
+        return coeff, steady, n_a
+
+    def envelope_coefficients(self, pool, rows, ch, params, frames):
+        # Koeffizienten wie envelope_ramps, der Zustand am Blockende (k = frames) wird gleich
+        # in den Pool zurückgeschrieben. Alle Kernel rechnen die Rampe mit denselben float32
+        # Operationen und landen genau dort
+        coeff, steady, n_a = self.envelope_ramps(pool, rows, ch, params)
+        up0, up, down0, down, floor = coeff
+        phase = pool.env_phase[rows]
+        s = params["sustain32"][ch]
+        attack = phase == ENV_ATTACK
+        release = phase == ENV_RELEASE
+
+        # Zustand am Blockende
+        k = self.frame_steps(frames)[frames]
+        last = np.minimum(up * k + up0, np.maximum(down0 - down * k, floor))
+        new_phase = np.where(last > s, ENV_DECAY, np.where(s > SILENCE_LEVEL, ENV_SUSTAIN, ENV_OFF))
+        new_phase[attack & (frames < n_a)] = ENV_ATTACK
+        new_phase[release] = np.where(last[release] > SILENCE_LEVEL, ENV_RELEASE, ENV_OFF)
+        # Sustain auf 0 gedreht: Stimme ist stumm, bis zum Note Off muss sie nicht mitlaufen
+        new_phase[steady] = np.where(floor[steady] <= SILENCE_LEVEL, ENV_OFF, phase[steady])
+        pool.env_phase[rows] = new_phase
+        pool.env_level[rows] = last
+        return coeff, steady
+
+    def envelope_ends(self, pool, rows, ch, params):
+        # Samples, nach denen jede Stimme aus rows (Melodie mit Envelope) ausgeklungen ist,
+        # also envelope_coefficients für einen so langen Block ENV_OFF liefert. -1 für
+        # Stimmen, die weiter klingen. Release endet unter SILENCE_LEVEL, Decay auf einen
+        # Sustain von 0 am Sustain. Geschlossene Form in float64, danach mit derselben
+        # float32 Rechnung wie am Blockende auf das genaue Sample korrigiert
+        ends = np.full(len(rows), -1, dtype=np.int64)
+        phase = pool.env_phase[rows]
+        s = params["sustain32"][ch]
+        fading = (phase == ENV_RELEASE) | ((phase < ENV_SUSTAIN) & (s <= SILENCE_LEVEL))
+        if not fading.any():
+            return ends
+        fading = np.flatnonzero(fading)
+        coeff, _, _ = self.envelope_ramps(pool, rows[fading], ch[fading], params)
+        _, _, down0, down, floor = coeff
+        limit = np.where(phase[fading] == ENV_RELEASE, np.float32(SILENCE_LEVEL), floor)
+
+        def done(k):
+            return np.maximum(down0 - down * k.astype(np.float32), floor) <= limit
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            k = np.ceil((down0.astype(np.float64) - limit) / down)
+        # Schon am Start still (z.B. Release ab Pegel 0): nach dem ersten Sample aus
+        k[down0 <= limit] = 1
+        k = np.where(np.isfinite(k), np.maximum(k, 1), -1).astype(np.int64)
+        k += ~done(k) & (k > 0)
+        k -= done(k - 1) & (k > 1)
+        ends[fading] = k
+        return ends
+
+    def render_envelopes(self, pool, rows, ch, params, frames, state_only=False):
+        # Hüllkurven (Stimmen x frames) der NumPy Referenz, Zustand siehe envelope_coefficients.
+        # state_only: nur den Zustand weiterschalten (Vorspulen bis zu einem Segmentanfang)
+        coeff, steady = self.envelope_coefficients(pool, rows, ch, params, frames)
+        if state_only:
+            return None
+        env = self.block_buffer("env", len(rows), frames)
+        if steady.any():
+            env[steady] = coeff[2, steady, None]
+
+        moving = np.flatnonzero(~steady)
+        if moving.size == 0:
+            return env
+
+        up0, up, down0, down, floor = coeff[:, moving]
+        k = self.frame_steps(frames)[1:]
+        ramp = self.block_buffer("env_ramp", moving.size, frames)
+        fall = self.block_buffer("env_fall", moving.size, frames)
+        np.multiply.outer(up, k, out=ramp)
+        ramp += up0[:, None]
+        np.multiply.outer(down, k, out=fall)
+        np.subtract(down0[:, None], fall, out=fall)
+        np.maximum(fall, floor[:, None], out=fall)
+        np.minimum(ramp, fall, out=ramp)
+        env[moving] = ramp
+        return env
+
+    def _render_envelope_reference(self, data, cs, frames):
+        # Alte Sample-fuer-Sample Variante, nur noch als Referenz fuer den Benchmark
+        a = cs["attack"]
+        d = cs["decay"]
+        s = cs["sustain"]
+        r = cs["release"]
+
+        env = np.zeros(frames)
+        for i in range(frames):
+            dt = 1.0 / self.sample_rate
+
+            if data['env_phase'] == 'attack':
+                data['env_level'] += dt / max(0.001, a)
+                if data['env_level'] >= 1.0:
+                    data['env_level'] = 1.0
+                    data['env_phase'] = 'decay'
+
+            elif data['env_phase'] == 'decay':
+                data['env_level'] -= dt * (1.0 - s) / max(0.001, d)
+                if data['env_level'] <= s:
+                    data['env_level'] = s
+                    data['env_phase'] = 'sustain'
+
+            elif data['env_phase'] == 'sustain':
+                data['env_level'] = s
+
+            elif data['env_phase'] == 'release':
+                data['env_level'] -= dt * data['release_level'] / max(0.001, r)
+                if data['env_level'] <= 0.0:
+                    data['env_level'] = 0.0
+                    data['env_phase'] = 'off'
+
+            env[i] = data['env_level']
+
+        return env
+
+    def audio_callback(self, outdata, frames, time_info, status):
+        if status: self.metrics.record_status(status)
+        t0 = time.perf_counter()
+        start = self.current_sample_index
+        self.record_dac_clock(time_info, start)
+        try:
+            # Live Playback ist fehlertolerant
+            self.render_block(outdata, frames)
+        except Exception as e:
+            # Im Zweifel Stille ausgeben statt abstürzen, aber mitzählen
+            self.metrics.record_exception(e)
+            outdata[:] = 0.0
+            self.current_sample_index = start + frames
+        self.metrics.record(time.perf_counter() - t0, frames, self.sample_rate, self.voice_count())
+
+    def record_dac_clock(self, time_info, sample):
+        # Wann das erste Sample dieses Blocks hörbar wird (Stream-Uhr), für die Latenzmessung
+        if time_info is None: return
+        dac = time_info.outputBufferDacTime
+        if not dac and self.stream is not None:
+            # Manche Treiber liefern keine DAC Zeit
+            dac = time_info.currentTime + self.stream.latency
+        self.dac_clock = (dac, sample)
+
+    def voice_count(self):
+        return int(np.count_nonzero(self.voices.active))
+
+    def render_block(self, outdata, frames):
+        # Block an den Event-Grenzen aus der EventQueue aufteilen, damit jedes Event genau
+        # auf seinem Sample landet, egal wie groß der Block ist. Zu späte Events starten am
+        # Blockanfang. NumPy läuft dabei mit kleinen Iterationspuffern (RENDER_BUFSIZE)
+        old_bufsize = np.setbufsize(RENDER_BUFSIZE)
+        try:
+            self.render_events(outdata, frames)
+        finally:
+            np.setbufsize(old_bufsize)
+
+    def render_events(self, outdata, frames):
+        pos = 0
+        while pos < frames:
+            ev = self.events.peek()
+            end = frames
+            if ev is not None:
+                offset = ev[0] - self.current_sample_index
+                if offset <= 0:
+                    self.events.pop()
+                    self.apply_event(ev)
+                    continue
+                end = min(frames, pos + offset)
+
+            self.generate_chunk(end - pos, self.current_sample_index, outdata[pos:end])
+            self.current_sample_index += end - pos
+            pos = end
+
+        # Events, die genau auf die Blockgrenze fallen, gleich noch anwenden
+        while True:
+            ev = self.events.peek()
+            if ev is None or ev[0] > self.current_sample_index:
+                break
+            self.events.pop()
+            self.apply_event(ev)
+
+    def apply_event(self, ev):
+        sample, event, note, velocity, channel, drum, age = ev
+        if event == EVENT_NOTE_ON:
+            self.note_on(note, velocity, channel, drum, age)
+        elif event == EVENT_NOTE_OFF:
+            self.note_off(note, channel)
+        elif event == EVENT_PITCH_BEND:
+            self.pitch_bend(channel, velocity)
+        else:
+            self.release_all()
+
+    def schedule(self, sample, event, note=0, velocity=0, channel=0, drum=None, age=0):
+        # Vom Sequencer Thread aus: Event für ein bestimmtes Sample einreihen
+        return self.events.push(sample, event, note, velocity, channel, drum, age)
+
+    def buffered_callback(self, outdata, frames, time_info, status):
+        # Look-Ahead Modus: nur aus dem Ringpuffer kopieren, fehlende Frames sind Stille
+        if status: self.metrics.record_status(status)
+        self.record_dac_clock(time_info, self.ahead.read)
+        n = self.ahead.read_into(outdata, frames)
+        if n < frames:
+            outdata[n:] = 0
+            # Stille vor dem ersten gerenderten Block ist kein Aussetzer
+            if self.ahead.read > self.ahead.start:
+                self.metrics.underruns += 1
+
+    def render_ahead(self, ahead, frames):
+        # Vom Render Thread aus: einen Block in den Look-Ahead Puffer rendern
+        block = self.block_buffer("ahead", frames, 2)
+        t0 = time.perf_counter()
+        start = self.current_sample_index
+        try:
+            self.render_block(block, frames)
+        except Exception as e:
+            self.metrics.record_exception(e)
+            block[:] = 0.0
+            self.current_sample_index = start + frames
+        self.metrics.record(time.perf_counter() - t0, frames, self.sample_rate, self.voice_count())
+        ahead.write(block)
+
+    @property
+    def playback_index(self):
+        # Sample, das gerade hörbar ist (im Look-Ahead Modus hinkt es dem Rendern hinterher)
+        return self.ahead.read if self.ahead is not None else self.current_sample_index
+
+    def start_stream(self):
+        self.stop_stream()
+        self.metrics.reset()
+        if sd is None:
+            raise RuntimeError("sounddevice ist nicht verfügbar, Live Playback nicht möglich")
+        callback = self.audio_callback
+        if self.latency_ms > 0:
+            block = self.block_size or 1024
+            depth = int(np.ceil(self.latency_ms * self.sample_rate / 1000.0 / block)) * block
+            self.ahead = RenderBuffer(max(depth, 2 * block), self.current_sample_index)
+            callback = self.buffered_callback
+        self.stream = sd.OutputStream(channels=2, samplerate=self.sample_rate, blocksize=self.block_size,
+                                      callback=callback)
+        self.stream.start()
+
+    def stop_stream(self):
+        if self.stream:
+            try:
+                self.stream.stop()
+                self.stream.close()
+            except: pass
+            self.stream = None
+            if self.metrics_path:
+                self.metrics.dump(self.metrics_path)
+        self.ahead = None
+
+    def add_voice(self, pool, note, velocity, channel, drum=None, start_time=None):
+        if drum is None:
+            drum = channel == self.drum_channel
+        if drum:
+            if note < SNARE_MIN_NOTE: kind = KIND_KICK
+            else: kind = KIND_SNARE
+        else:
+            kind = KIND_MELODY
+
+        now = self.current_sample_index if start_time is None else start_time
+        loudness = self.voice_loudness(pool) if pool.active.all() else None
+        slot = pool.allocate(channel, note, loudness, now)
+        # Neuer Anschlag einer Note, die noch klingt (gleicher Slot, auch wenn ihr Note Off
+        # ohne Envelope am selben Sample kam): die Phase läuft weiter, ein Sprung in der
+        # Wellenform wäre ohne Envelope ein Knacken. Sonst beginnt sie bei 0. Der
+        # Span-Renderer übernimmt die Phase dafür von der abgeschnittenen Note
+        same = pool.channel[slot] == channel and pool.note[slot] == note
+        if not (same and (pool.active[slot] or pool.stop[slot] == now)):
+            pool.phase[slot] = 0.0
+        pool.stop[slot] = -1
+        pool.active[slot] = True
+        pool.kind[slot] = kind
+        pool.channel[slot] = channel
+        pool.note[slot] = note
+        pool.freq[slot] = self.get_freq(note)
+        pool.vel[slot] = velocity / 127.0
+        pool.start[slot] = now
+
+        # Envelope parameter
+        pool.env_phase[slot] = ENV_ATTACK
+        pool.env_level[slot] = 0.0
+        pool.release_level[slot] = 0.0
+        return slot
+
+    def release_slot(self, pool, slot):
+        # Note Off für eine Stimme: Release mit Envelope, sonst sofort aus
+        if pool.kind[slot] != KIND_MELODY:
+            return
+        if self.patch["env_enabled"][pool.channel[slot]]:
+            # Release ab aktuellem Pegel, die Stimme wird nach dem Ausklingen entfernt
+            if pool.env_phase[slot] < ENV_RELEASE:
+                pool.release_level[slot] = pool.env_level[slot]
+                pool.env_phase[slot] = ENV_RELEASE
+        else:
+            pool.active[slot] = False
+            pool.stop[slot] = self.current_sample_index
+
+    def drum_length(self, kind):
+        # Samples bis der Drum-Ausklang unter SILENCE_LEVEL fällt
+        if kind == KIND_KICK:
+            decay = max(0.01, self.kick_decay)
+        else:
+            decay = max(max(0.01, self.snare_decay), 1.0 / 15.0)
+        return int(np.ceil(decay * np.log(1.0 / SILENCE_LEVEL) * self.sample_rate))
+
+    def note_on(self, note, velocity, channel, drum=None, age=0):
+        with self.lock:
+            slot = self.add_voice(self.voices, note, velocity, channel, drum, self.current_sample_index - age)
+            if age > 0:
+                self.resume_envelope(self.voices, slot, age)
+
+    def note_off(self, note, channel):
+        with self.lock:
+            slot = self.voices.find(channel, note)
+            if slot >= 0:
+                self.release_slot(self.voices, slot)
+
+    def pitch_bend(self, channel, value):
+        # Pitchwheel (-8192..8191), gilt ab dem Event-Sample für alle Stimmen des Kanals.
+        # Die Phase läuft stetig weiter, nur ihr Tempo ändert sich
+        with self.lock:
+            self.bend[channel] = value / 8192.0 * PITCH_BEND_RANGE
+
+    def resume_envelope(self, pool, slot, age):
+        # Stimme, die beim Seek schon age Samples klingt: nach Attack+Decay direkt auf Sustain,
+        # sonst normal mit dem Attack anfangen
+        params, ch = self.patch, pool.channel[slot]
+        if pool.kind[slot] == KIND_MELODY and params["env_enabled"][ch]:
+            if age >= (params["attack"][ch] + params["decay"][ch]) * self.sample_rate:
+                pool.env_phase[slot] = ENV_SUSTAIN
+                pool.env_level[slot] = params["sustain"][ch]
+
+    def release_all(self):
+        # Alle Melodie-Stimmen loslassen, Drums klingen von selbst aus
+        with self.lock:
+            pool = self.voices
+            for slot in np.flatnonzero(pool.active).tolist():
+                self.release_slot(pool, slot)
+
+    def all_notes_off(self):
+        with self.lock:
+            self.voices.clear()
+
+
+class LiveInput:
+    """Live Modus: MIDI Eingang über python-rtmidi direkt in den Synth.
+
+    rtmidi liefert zu jeder Nachricht den Abstand zur vorherigen (Hardware-Zeitstempel).
+    Daraus wird ein Ziel-Sample mit konstantem Vorlauf von einem Block, so landen die
+    Noten ohne Jitter über die EventQueue im Audio Callback. Läuft die Uhr weg (Event
+    zu spät oder zu weit in der Zukunft), wird neu verankert. Für jedes Note On wird
+    gemessen, wann es tatsächlich hörbar ist (Latenz Eingang -> Ausgang).
+    """
+
+    def __init__(self, synth, port=None):
+        if rtmidi is None:
+            raise RuntimeError("python-rtmidi ist nicht installiert, Live Modus nicht möglich")
+        self.synth = synth
+        self.port = port
+        self.midi_in = None
+        self.hw_time = 0.0
+        self.offset = None  # Ziel-Sample = hw_time * sample_rate + offset
+        self.last_target = 0
+        self.pending = []   # (Ziel-Sample, Stream-Zeit beim Eintreffen) für die Latenzmessung
+        self.lock = threading.Lock()
+        self.latency_ms = 0
+
+    @staticmethod
+    def ports():
+        if rtmidi is None:
+            return []
+        return rtmidi.MidiIn().get_ports()
+
+    def open(self):
+        self.midi_in = rtmidi.MidiIn()
+        ports = self.midi_in.get_ports()
+        if not ports:
+            raise RuntimeError("Kein MIDI Eingang gefunden")
+        index = 0
+        if isinstance(self.port, int):
+            index = self.port
+        elif self.port:
+            matches = [i for i, name in enumerate(ports) if self.port in name]
+            if not matches:
+                raise RuntimeError(f"MIDI Eingang nicht gefunden: {self.port}")
+            index = matches[0]
+        self.midi_in.open_port(index)
+        self.midi_in.set_callback(self.on_message)
+        return ports[index]
+
+    def close(self):
+        if self.midi_in is not None:
+            self.midi_in.cancel_callback()
+            self.midi_in.close_port()
+            self.midi_in = None
+
+    def start(self):
+        # Live spielt immer direkt im Callback, ein Look-Ahead Puffer wäre nur zusätzliche Latenz
+        synth = self.synth
+        synth.reset_state()
+        self.latency_ms, synth.latency_ms = synth.latency_ms, 0
+        self.hw_time, self.offset, self.last_target = 0.0, None, 0
+        self.pending = []
+        try:
+            synth.start_stream()
+            return self.open()
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        self.close()
+        self.synth.stop_stream()
+        self.synth.latency_ms = self.latency_ms
+
+    def stream_time(self):
+        stream = self.synth.stream
+        return stream.time if stream is not None else time.perf_counter()
+
+    def target_sample(self, delta):
+        synth = self.synth
+        self.hw_time += delta
+        block = synth.block_size or 256
+        now = synth.current_sample_index
+        target = None if self.offset is None else int(self.hw_time * synth.sample_rate + self.offset)
+        if target is None or target < now or target > now + 4 * block:
+            # (Neu) verankern: ein Block Vorlauf ab jetzt
+            self.offset = now + block - self.hw_time * synth.sample_rate
+            target = now + block
+        # Die Queue braucht aufsteigende Zeiten
+        target = max(target, self.last_target)
+        self.last_target = target
+        return target
+
+    def on_message(self, event, data=None):
+        # Läuft im rtmidi Thread (einziger Producer der EventQueue)
+        message, delta = event
+        if len(message) < 3:
+            return
+        status, note, velocity = message[0] & 0xF0, message[1], message[2]
+        channel = message[0] & 0x0F
+        if status not in (0x80, 0x90, 0xE0):
+            return
+        target = self.target_sample(delta)
+        if status == 0xE0:
+            # Pitchwheel: 14 Bit aus LSB (note) und MSB (velocity), Mitte 8192
+            self.synth.schedule(target, EVENT_PITCH_BEND, 0, ((velocity << 7) | note) - 8192, channel)
+        elif status == 0x90 and velocity > 0:
+            self.synth.schedule(target, EVENT_NOTE_ON, note, velocity, channel)
+            with self.lock:
+                self.pending.append((target, self.stream_time()))
+        else:
+            self.synth.schedule(target, EVENT_NOTE_OFF, note, 0, channel)
+        self.update_latency()
+
+    def update_latency(self):
+        # Note Ons, deren Block schon ausgegeben wurde, mit der DAC Zeit des Streams abrechnen
+        clock = self.synth.dac_clock
+        if clock is None:
+            return
+        dac, sample = clock
+        sr = self.synth.sample_rate
+        with self.lock:
+            while self.pending and self.pending[0][0] < sample:
+                target, arrived = self.pending.pop(0)
+                self.synth.metrics.record_input_latency(dac + (target - sample) / sr - arrived)
+
+
+class Sequencer:
+    """Speist die EventQueue des Synths aus der Song-Timeline, mit Seek und Loop.
+
+    Ziel-Sample eines Events = base + Song-Sample. Ein Seek (oder Loop-Sprung) lässt alle
+    Stimmen los, setzt base neu und startet die Noten, die an der neuen Stelle schon
+    klingen, mit ihrem Alter neu. Der Stream läuft dabei einfach weiter.
+    """
+
+    def __init__(self, synth, song, start=0):
+        self.synth = synth
+        self.song = song
+        self.loop = None  # (Start, Ende) in Song-Samples
+        self.seek_to = start
+        self.running = True
+        sr = synth.sample_rate
+        self.tl, samples, kind, index = song.events(sr, synth.drum_channel)
+        self.samples = samples
+        self.sample_list = samples.tolist()
+        self.events = kind.tolist()
+        self.index = index.tolist()
+        self.song_end = self.sample_list[-1] if self.sample_list else 0
+        # Zuordnung Ziel-Sample -> base, damit die UI die Songposition anzeigen kann
+        self.marks = [(synth.current_sample_index, synth.current_sample_index - start)]
+
+    def seek(self, pos):
+        # Aus dem UI Thread, wird beim nächsten Durchlauf von run() ausgeführt
+        self.seek_to = int(pos)
+
+    def position(self):
+        # Gerade hörbares Song-Sample
+        now = self.synth.playback_index
+        base = self.marks[0][1]
+        for at, b in self.marks:
+            if at > now:
+                break
+            base = b
+        return now - base
+
+    def run(self):
+        synth = self.synth
+        sr = synth.sample_rate
+        tl = self.tl
+        notes = tl["note"].tolist()
+        velocities = tl["velocity"].tolist()
+        channels = tl["channel"].tolist()
+        drums = tl["drum"].tolist()
+        bend_channels = self.song.bend_channels.tolist()
+        bend_values = self.song.bend_values.tolist()
+        drum_tail = max(synth.drum_length(KIND_KICK), synth.drum_length(KIND_SNARE))
+        samples, n = self.sample_list, len(self.sample_list)
+
+        # Vorlauf: ein Block Pre-Roll und mindestens 100 ms Look-Ahead
+        block = synth.block_size or 1024
+        lookahead = max(int(0.1 * sr), 2 * block)
+        # Im Look-Ahead Modus rendert dieser Thread selbst voraus, der Callback kopiert nur
+        ahead = synth.ahead
+        last = synth.current_sample_index + block  # Neue Events dürfen nicht davor liegen
+        base, k = 0, 0
+
+        def push(*ev):
+            while self.running and not synth.schedule(*ev):
+                time.sleep(0.01)
+
+        def jump(pos, at):
+            # Ab Ziel-Sample at weiterspielen, als wäre der Song bei pos
+            nonlocal base, k, last
+            at = max(at, last)
+            push(at, EVENT_RELEASE_ALL)
+            # Pitchwheel Stand an der neuen Stelle
+            for channel, value in self.song.bends_at(sr, pos):
+                push(at, EVENT_PITCH_BEND, 0, value, channel)
+            for i in self.song.sounding(sr, synth.drum_channel, pos, drum_tail).tolist():
+                age = pos - int(tl["start"][i])
+                push(at, EVENT_NOTE_ON, notes[i], velocities[i], channels[i], drums[i], age)
+            base, last = at - pos, at
+            k = int(np.searchsorted(self.samples, pos, side="left"))
+            self.marks = self.marks[-8:] + [(at, base)]
+
+        while self.running:
+            if self.seek_to is not None:
+                pos, self.seek_to = self.seek_to, None
+                jump(pos, synth.current_sample_index + block)
+
+            loop = self.loop
+            horizon = synth.current_sample_index + lookahead
+            while True:
+                if loop and loop[1] > loop[0] and (k == n or samples[k] >= loop[1]):
+                    if base + loop[1] > horizon:
+                        break
+                    jump(loop[0], base + loop[1])
+                    continue
+                if k == n or base + samples[k] > horizon:
+                    break
+                i = self.index[k]
+                last = base + samples[k]
+                if self.events[k] == EVENT_PITCH_BEND:
+                    push(last, EVENT_PITCH_BEND, 0, bend_values[i], bend_channels[i])
+                else:
+                    push(last, self.events[k], notes[i], velocities[i], channels[i], drums[i])
+                k += 1
+
+            if not loop and k == n and synth.playback_index >= base + self.song_end:
+                break
+
+            # Nur rendern, wenn alle Events des nächsten Blocks in der Queue sind
+            next_event = base + samples[k] if k < n else None
+            if loop and (next_event is None or samples[k] >= loop[1]):
+                next_event = base + loop[1]
+            ready = next_event is None or next_event >= synth.current_sample_index + block
+            if ahead is not None and ready and ahead.free() >= block:
+                synth.render_ahead(ahead, block)
+            elif ahead is not None:
+                time.sleep(block / sr / 2)
+            else:
+                time.sleep(lookahead / sr / 4)
+
+
+# Synth Attribute, die per Settings-JSON (Patch) gesetzt werden dürfen
+SYNTH_SETTINGS = (
+    "sample_rate", "max_polyphony", "drum_channel", "bit_depth",
+    "block_size", "latency_ms", "metrics_path", "kernel", "oscillator",
+    "kick_vol", "kick_decay", "kick_type", "kick_noise_period",
+    "snare_vol", "snare_decay", "snare_body", "snare_type", "snare_noise_period",
+)
+# Erlaubte Werte in Settings (Synth und Kanäle): Zahlen mit (Minimum, Maximum), None = offen.
+# SETTING_INTS müssen ganze Zahlen sein, SETTING_FLAGS an/aus (bool, 0 oder 1), SETTING_TEXT Text
+SETTING_RANGES = {
+    "sample_rate": (8000, 192000), "max_polyphony": (1, 1024), "drum_channel": (0, 15),
+    "bit_depth": (1, None), "block_size": (0, 16384), "latency_ms": (0, 2000),
+    "kick_vol": (0, 4), "kick_decay": (0.001, 10), "kick_noise_period": (0, len(NES_NOISE_PERIODS) - 1),
+    "snare_vol": (0, 4), "snare_decay": (0.001, 10), "snare_body": (0, 1),
+    "snare_noise_period": (0, len(NES_NOISE_PERIODS) - 1),
+    "volume": (0, 4), "pulse_width": (0, 1), "pan": (-1, 1),
+    "attack": (0, 10), "decay": (0, 10), "sustain": (0, 1), "release": (0, 10),
+    "pw_start": (0, 1), "pw_stop": (0, 1), "pw_bounce_time": (0, 10),
+    "vibrato_depth": (0, 12), "vibrato_rate": (0, 50),
+}
+SETTING_INTS = ("sample_rate", "max_polyphony", "drum_channel", "block_size", "kick_noise_period", "snare_noise_period")
+SETTING_FLAGS = ("env_enabled", "pw_enabled", "pw_bounce")
+SETTING_TEXT = ("kernel", "oscillator", "kick_type", "snare_type", "waveform")
+
+
+def check_number(name, value, low=None, high=None, integer=False):
+    # ValueError, wenn value keine Zahl (bzw. ganze Zahl) zwischen low und high ist. bool und
+    # NaN zählen nicht als Zahl
+    if isinstance(value, bool) or not isinstance(value, numbers.Integral if integer else numbers.Real):
+        raise ValueError(f"{name} muss eine {'ganze Zahl' if integer else 'Zahl'} sein, nicht {value!r}")
+    if not ((low is None or value >= low) and (high is None or value <= high)) or value != value:
+        limits = f"zwischen {low} und {high}" if high is not None else f"mindestens {low}"
+        raise ValueError(f"{name} muss {limits} sein, nicht {value}")
+    return value
+
+
+def check_setting(key, value):
+    # Typ und Wertebereich einer Einstellung, siehe SETTING_RANGES
+    if key in SETTING_RANGES:
+        low, high = SETTING_RANGES[key]
+        check_number(key, value, low, high, key in SETTING_INTS)
+    elif key in SETTING_FLAGS:
+        if isinstance(value, numbers.Real) and value in (0, 1):
+            return
+        raise ValueError(f"{key} muss true oder false sein, nicht {value!r}")
+    elif key in SETTING_TEXT and not isinstance(value, str):
+        raise ValueError(f"{key} muss ein Text sein, nicht {value!r}")
+    elif key == "metrics_path" and not (value is None or isinstance(value, str)):
+        raise ValueError(f"metrics_path muss ein Pfad sein, nicht {value!r}")
+
+
+def apply_settings(synth, settings):
+    for key, value in settings.items():
+        if key == "channels":
+            if not isinstance(value, dict):
+                raise ValueError("channels muss ein Objekt {Kanal: Einstellungen} sein")
+            for ch, values in value.items():
+                cs = synth.channel_settings.get(int(ch)) if str(ch).lstrip("-").isdigit() else None
+                if cs is None:
+                    raise ValueError(f"Ungültiger Kanal: {ch} (erlaubt sind 0 bis 15)")
+                if not isinstance(values, dict):
+                    raise ValueError(f"Einstellungen für Kanal {ch} müssen ein Objekt sein")
+                unknown = set(values) - set(cs)
+                if unknown:
+                    raise ValueError(f"Unbekannte Kanal-Einstellung(en): {', '.join(sorted(unknown))}")
+                for name, v in values.items():
+                    check_setting(name, v)
+                cs.update(values)
+        elif key in SYNTH_SETTINGS:
+            check_setting(key, value)
+            setattr(synth, key, value)
+        else:
+            raise ValueError(f"Unbekannte Einstellung: {key}")
+    synth.publish_patch()
+
+
+def load_settings(synth, path):
+    with open(path) as f:
+        apply_settings(synth, json.load(f))
+
+
+# Kompilierte Noten: ein Eintrag pro Note, Zeiten in Samples
+NOTE_DTYPE = np.dtype([
+    ("start", np.int64),
+    ("end", np.int64),
+    ("note", np.uint8),
+    ("channel", np.uint8),
+    ("velocity", np.uint8),
+    ("drum", np.bool_),
+])
+
+
+class Song:
+    """MIDI Datei, die beim Laden einmal zu einer Notenliste kompiliert wird.
+
+    Tempowechsel sind danach aufgelöst, Playback und Export arbeiten nur noch
+    auf NumPy Arrays statt auf mido Nachrichten.
+    """
+
+    def __init__(self, midi_file):
+        starts, ends, notes, channels, velocities = [], [], [], [], []
+        bend_times, bend_channels, bend_values = [], [], []
+        sounding = {}
+        t = 0.0
+
+        # mido mischt die Spuren und rechnet die Deltas schon in Sekunden um
+        for msg in midi_file:
+            t += msg.time
+            if msg.type == 'pitchwheel':
+                bend_times.append(t)
+                bend_channels.append(msg.channel)
+                bend_values.append(msg.pitch)
+                continue
+            if msg.type not in ('note_on', 'note_off'):
+                continue
+            key = (msg.channel, msg.note)
+            if key in sounding:
+                # Note Off (oder erneutes Note On) beendet die laufende Note
+                ends[sounding.pop(key)] = t
+            if msg.type == 'note_on' and msg.velocity > 0:
+                sounding[key] = len(starts)
+                starts.append(t)
+                ends.append(t)
+                notes.append(msg.note)
+                channels.append(msg.channel)
+                velocities.append(msg.velocity)
+
+        # Nicht beendete Noten laufen bis zum Songende
+        for i in sounding.values():
+            ends[i] = t
+
+        self.length = t
+        order = np.argsort(np.array(starts, dtype=np.float64), kind="stable")
+        self.start_sec = np.array(starts, dtype=np.float64)[order]
+        self.end_sec = np.array(ends, dtype=np.float64)[order]
+        self.notes = np.array(notes, dtype=np.uint8)[order]
+        self.channels = np.array(channels, dtype=np.uint8)[order]
+        self.velocities = np.array(velocities, dtype=np.uint8)[order]
+        # Pitchwheel Events (schon zeitlich sortiert), Wert -8192..8191
+        self.bend_sec = np.array(bend_times, dtype=np.float64)
+        self.bend_channels = np.array(bend_channels, dtype=np.uint8)
+        self.bend_values = np.array(bend_values, dtype=np.int16)
+        self._timelines = {}
+        self._events = {}
+        self._note_keys = {}
+        self._bends = {}
+        self._digest = None
+
+    @classmethod
+    def load(cls, path):
+        return cls(mido.MidiFile(path))
+
+    def digest(self):
+        # Fingerabdruck der Notenliste, z.B. für den Stem Cache
+        if self._digest is None:
+            h = hashlib.sha1(np.float64(self.length).tobytes())
+            for array in (self.start_sec, self.end_sec, self.notes, self.channels, self.velocities,
+                          self.bend_sec, self.bend_channels, self.bend_values):
+                h.update(array.tobytes())
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def length_samples(self, sample_rate):
+        return int(self.length * sample_rate)
+
+    def last_event_sample(self, sample_rate):
+        # Sample des letzten Note Offs oder Pitch Bends (0 ohne Events), dort endet der Song
+        # beim Rendern, eine Pause am Ende der MIDI Datei zählt nicht mit
+        ends = (self.end_sec * sample_rate).astype(np.int64)
+        return int(max(ends.max(initial=0), self.bend_samples(sample_rate).max(initial=0)))
+
+    def timeline(self, sample_rate, drum_channel):
+        key = (sample_rate, drum_channel)
+        if key not in self._timelines:
+            tl = np.empty(len(self.notes), dtype=NOTE_DTYPE)
+            tl["start"] = (self.start_sec * sample_rate).astype(np.int64)
+            tl["end"] = (self.end_sec * sample_rate).astype(np.int64)
+            tl["note"] = self.notes
+            tl["channel"] = self.channels
+            tl["velocity"] = self.velocities
+            tl["drum"] = self.channels == drum_channel
+            self._timelines[key] = tl
+        return self._timelines[key]
+
+    def events(self, sample_rate, drum_channel):
+        # Note On/Off und Pitch Bends als eine zeitlich sortierte Liste (Reihenfolge bei
+        # gleichem Sample siehe EVENT_ORDER, das Off einer Note der Länge 0 folgt direkt auf
+        # ihr On). index zeigt für Noten in die timeline, für Pitch Bends in
+        # bend_channels/bend_values.
+        # Die Tabelle ist nach Zeit sortiert, ein Seek ist damit ein searchsorted.
+        key = (sample_rate, drum_channel)
+        if key not in self._events:
+            tl = self.timeline(sample_rate, drum_channel)
+            n, m = len(tl), len(self.bend_sec)
+            samples = np.concatenate([tl["end"], tl["start"], self.bend_samples(sample_rate)])
+            kind = np.concatenate([np.full(n, EVENT_NOTE_OFF, dtype=np.int8), np.full(n, EVENT_NOTE_ON, dtype=np.int8),
+                                   np.full(m, EVENT_PITCH_BEND, dtype=np.int8)])
+            index = np.concatenate([np.arange(n), np.arange(n), np.arange(m)])
+            rank = EVENT_ORDER[kind]
+            zero = tl["end"] == tl["start"]
+            rank[:n][zero] = EVENT_ORDER[EVENT_NOTE_ON]
+            after = np.zeros(len(kind), dtype=np.int8)
+            after[:n] = zero
+            order = np.lexsort((after, index, rank, samples))
+            self._events[key] = (tl, samples[order], kind[order], index[order])
+        return self._events[key]
+
+    def bend_samples(self, sample_rate):
+        return (self.bend_sec * sample_rate).astype(np.int64)
+
+    def bend_index(self, sample_rate):
+        # Pro Kanal mit Pitch Bends: (Samples, Pitchwheel Werte), zeitlich sortiert und einmal
+        # pro Sample Rate aufgeteilt
+        if sample_rate not in self._bends:
+            samples = self.bend_samples(sample_rate)
+            self._bends[sample_rate] = {
+                ch: (samples[self.bend_channels == ch], self.bend_values[self.bend_channels == ch])
+                for ch in np.unique(self.bend_channels).tolist()
+            }
+        return self._bends[sample_rate]
+
+    def bend_curves(self, sample_rate):
+        # Pro Kanal mit Pitch Bends: (Samples, Halbtöne), z.B. für den Span-Renderer
+        return {ch: (samples, values / 8192.0 * PITCH_BEND_RANGE)
+                for ch, (samples, values) in self.bend_index(sample_rate).items()}
+
+    def bends_at(self, sample_rate, pos):
+        # (Kanal, Pitchwheel Wert) für jeden Kanal mit Pitch Bends, Stand direkt vor Sample pos
+        bends = []
+        for ch, (samples, values) in self.bend_index(sample_rate).items():
+            k = int(np.searchsorted(samples, pos, side="left"))
+            bends.append((ch, int(values[k - 1]) if k else 0))
+        return bends
+
+    def note_keys(self, sample_rate, drum_channel):
+        # Die timeline nach (Kanal, Note) gruppiert und darin nach Start sortiert, einmal pro
+        # timeline: order (Indizes in die timeline), keys (Kanal * 128 + Note je Gruppe),
+        # firsts (Anfang jeder Gruppe in order) und die Sortierschlüssel Gruppe * stride + Start
+        key = (sample_rate, drum_channel)
+        if key not in self._note_keys:
+            tl = self.timeline(sample_rate, drum_channel)
+            note_key = tl["channel"].astype(np.int64) * 128 + tl["note"]
+            order = np.lexsort((tl["start"], note_key))
+            keys, firsts = np.unique(note_key[order], return_index=True)
+            stride = int(tl["start"].max()) + 2 if len(tl) else 1
+            self._note_keys[key] = (order, keys, firsts, stride, note_key[order] * stride + tl["start"][order])
+        return self._note_keys[key]
+
+    def sounding(self, sample_rate, drum_channel, pos, drum_tail=0):
+        """Indizes (in timeline) der Noten, die bei Sample pos schon klingen.
+
+        Pro (Kanal, Note) gilt wie beim Playback nur der letzte Anschlag vor pos, den
+        liefert ein searchsorted über alle Gruppen aus note_keys. Der Aufwand hängt also nur
+        von der Zahl der Gruppen ab, nicht von der Länge der Noten. Drums zählen drum_tail
+        Samples lang.
+        """
+        tl = self.timeline(sample_rate, drum_channel)
+        order, keys, firsts, stride, sort_keys = self.note_keys(sample_rate, drum_channel)
+        if not len(tl):
+            return np.zeros(0, dtype=np.int64)
+        at = min(max(int(pos), 0), stride - 1)
+        last = np.searchsorted(sort_keys, keys * stride + at, side="left") - 1
+        hit = order[last[last >= firsts]]
+        end = np.where(tl["drum"][hit], tl["start"][hit] + drum_tail, tl["end"][hit])
+        return np.sort(hit[end > pos])
+
+
+# Größter Block beim Offline Rendering, damit lange Pausen nicht einen riesigen Chunk erzeugen
+EXPORT_BLOCK = 8192
+
+
+def iter_song_chunks(synth, song, progress=None, start=0, stop=None):
+    # Offline Rendering ohne Tk, liefert nacheinander (frames, 2) float Blöcke.
+    # start/stop (Event-Samples) begrenzen auf ein Segment: bis start wird nur der
+    # Stimmzustand vorgespult, ab dem ersten Event bei oder nach stop ist Schluss
+    synth.stop_stream()
+    synth.reset_state()
+
+    tl, samples, kind, index = song.events(synth.sample_rate, synth.drum_channel)
+    notes = tl["note"].tolist()
+    channels = tl["channel"].tolist()
+    velocities = tl["velocity"].tolist()
+    drums = tl["drum"].tolist()
+    bend_channels = song.bend_channels.tolist()
+    bend_values = song.bend_values.tolist()
+    total = max(1, song.length_samples(synth.sample_rate))
+
+    def render(frames):
+        while frames > 0:
+            n = min(frames, EXPORT_BLOCK)
+            if synth.current_sample_index < start:
+                synth.advance_chunk(n, synth.current_sample_index)
+            else:
+                block = np.empty((n, 2), dtype=np.float32)
+                synth.generate_chunk(n, synth.current_sample_index, block)
+                yield block
+            synth.current_sample_index += n
+            frames -= n
+
+    for count, (sample, event, i) in enumerate(zip(samples.tolist(), kind.tolist(), index.tolist()), 1):
+        if stop is not None and sample >= stop:
+            yield from render(stop - synth.current_sample_index)
+            return
+
+        if sample > synth.current_sample_index:
+            yield from render(sample - synth.current_sample_index)
+
+        if progress and count % 200 == 0:
+            progress(synth.current_sample_index / total)
+
+        if event == EVENT_NOTE_ON:
+            synth.note_on(notes[i], velocities[i], channels[i], drums[i])
+        elif event == EVENT_NOTE_OFF:
+            synth.note_off(notes[i], channels[i])
+        else:
+            synth.pitch_bend(bend_channels[i], bend_values[i])
+
+    # Letzter Ausklang
+    yield from render(int(synth.sample_rate))
+
+
+# Kürzere Segmente lohnen den Worker-Prozess nicht
+SEGMENT_MIN_SECONDS = 5.0
+
+
+def segment_bounds(song, sample_rate, drum_channel, count):
+    # Teilt den Song in bis zu count etwa gleich lange Segmente. Grenzen liegen immer auf
+    # einem Event-Sample, dort teilt auch der Chunk-Renderer, die Blöcke sind also dieselben
+    _, samples, _, _ = song.events(sample_rate, drum_channel)
+    if not len(samples):
+        return [0]
+    total = song.length_samples(sample_rate)
+    targets = np.arange(1, count) * (total / count)
+    cuts = samples[np.minimum(np.searchsorted(samples, targets), len(samples) - 1)]
+    return [0] + sorted(set(int(c) for c in cuts if c > 0))
+
+
+def render_segment_job(song, settings, start, stop, path):
+    # Worker: ein Segment [start, stop) des Songs als rohes float32 Stereo in eine Datei
+    synth = RetroSynth()
+    apply_settings(synth, settings)
+    frames = 0
+    with open(path, "wb") as f:
+        for block in iter_song_chunks(synth, song, start=start, stop=stop):
+            f.write(block.tobytes())
+            frames += len(block)
+    return frames
+
+
+def iter_song_segments(synth, song, progress=None, jobs=None):
+    """Chunk-Renderer, parallel über Zeitsegmente in Worker-Prozessen.
+
+    Jeder Worker spult die Events bis zu seinem Segmentanfang nur im Stimmzustand vor
+    (advance_chunk) und rendert dann sein Segment, das Ergebnis ist damit dasselbe wie
+    bei iter_song_chunks. Die Segmente kommen der Reihe nach zurück, während die
+    späteren noch rechnen.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    count = min(jobs, int(song.length / SEGMENT_MIN_SECONDS))
+    if count < 2:
+        yield from iter_song_chunks(synth, song, progress)
+        return
+
+    synth.stop_stream()
+    bounds = segment_bounds(song, synth.sample_rate, synth.drum_channel, count)
+    settings = current_settings(synth)
+    work_dir = tempfile.mkdtemp(prefix="8bit-segments-")
+    try:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(bounds))) as pool:
+            futures = []
+            for i, start in enumerate(bounds):
+                stop = bounds[i + 1] if i + 1 < len(bounds) else None
+                path = os.path.join(work_dir, f"{i}.f32")
+                futures.append((pool.submit(render_segment_job, song, settings, start, stop, path), path))
+
+            for i, (future, path) in enumerate(futures, 1):
+                frames = future.result()
+                if frames:
+                    data = np.memmap(path, dtype=np.float32, mode="r", shape=(frames, 2))
+                    for pos in range(0, frames, EXPORT_BLOCK):
+                        yield np.array(data[pos:pos + EXPORT_BLOCK])
+                    del data
+                os.remove(path)
+                if progress: progress(i / len(futures))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def iter_song_spans(synth, song, progress=None):
+    # Alternative Offline Engine: jede Note wird genau über ihre Lebensdauer in einen
+    # vorab angelegten Puffer gerendert, Stille und Event-Chunks kosten nichts mehr.
+    # Normalisierung und Bitcrusher laufen danach einmal über den ganzen Song.
+    synth.stop_stream()
+    synth.reset_state()
+
+    sr = synth.sample_rate
+    tl = song.timeline(sr, synth.drum_channel)
+    total = song_total_samples(song, sr)
+    out = np.zeros((2, total), dtype=np.float32)
+    voice_count = np.zeros(total + 1, dtype=np.int16)
+
+    render_spans(synth, tl, np.arange(len(tl)), total, synth.channel_params(), out, voice_count, progress,
+                 song.bend_curves(sr))
+    np.cumsum(voice_count, out=voice_count)
+    yield from mix_spans(synth, total, voice_count, lambda pos, stop: out[:, pos:stop])
+
+
+def song_total_samples(song, sample_rate):
+    # Letztes Event plus eine Sekunde Ausklang, genau wie iter_song_chunks rendert
+    return song.last_event_sample(sample_rate) + int(sample_rate)
+
+
+def span_cuts(tl, total):
+    # Wie im Chunk-Renderer ersetzt ein neues Note On auf gleichem (Kanal, Note) die alte Stimme
+    key = tl["channel"].astype(np.int64) * 128 + tl["note"]
+    order = np.lexsort((tl["start"], key))
+    same = key[order][1:] == key[order][:-1]
+    cut = np.full(len(tl), total, dtype=np.int64)
+    cut[order[:-1][same]] = tl["start"][order[1:]][same]
+    return cut
+
+
+def render_spans(synth, tl, select, total, params, out, voice_count, progress=None, bends=None):
+    # Rendert die Noten tl[select] über ihre Lebensdauer in out (Zeilen = Kanäle der Ausgabe)
+    # und trägt ihre Lebensdauer als +1/-1 in voice_count ein.
+    # bends (Song.bend_curves): Pitch Bends pro Kanal, Blöcke werden an ihnen geteilt
+    cut = span_cuts(tl, total)
+    bends = bends or {}
+    saved_bend = synth.bend.copy()
+    # (Kanal, Note) -> (Sample, Phase) einer Stimme, die beim nächsten Anschlag derselben
+    # Note noch klingt. Der Chunk-Renderer schlägt dann denselben Slot an, die Phase läuft weiter
+    carry = {}
+
+    # Eine Stimme im eigenen Pool, gerendert mit demselben Kernel wie generate_chunk
+    pool = VoicePool(1)
+    rows = np.zeros(1, dtype=np.int64)
+    width = len(out)
+
+    for count, i in enumerate(select.tolist()):
+        if progress and count % 200 == 0:
+            progress(count / max(1, len(select)))
+
+        start, end, note, ch, vel, drum = tl[i].tolist()
+        pool.clear()
+        slot = synth.add_voice(pool, note, vel, ch, drum, start)
+        carried = carry.pop((ch, note), None)
+        if carried is not None and carried[0] == start:
+            pool.phase[slot] = carried[1]
+        kind = pool.kind[slot]
+        stop = min(int(cut[i]), total)
+        enveloped = kind == KIND_MELODY and params["env_enabled"][ch]
+
+        if kind != KIND_MELODY:
+            # Drums enden wie im Chunk-Renderer, sobald sie unter SILENCE_LEVEL sind
+            stop = audible = min(stop, start + synth.drum_length(kind))
+        elif enveloped:
+            audible = stop
+        else:
+            stop = audible = min(stop, end)
+
+        curve = bends.get(ch) if kind == KIND_MELODY else None
+        pos = start
+        while pos < audible:
+            n = min(EXPORT_BLOCK, audible - pos)
+            if enveloped and pos < end:
+                n = min(n, end - pos)
+            elif enveloped:
+                synth.release_slot(pool, slot)
+            if enveloped:
+                # Der Block endet, wo die Envelope ausklingt (wie im Chunk-Renderer)
+                tail = int(synth.envelope_ends(pool, rows, pool.channel[rows], params)[0])
+                if tail > 0:
+                    n = min(n, tail)
+            if curve is not None:
+                # Letzter Bend bis pos gilt, der Block endet vor dem nächsten
+                k = int(np.searchsorted(curve[0], pos, side="right"))
+                synth.bend[ch] = curve[1][k - 1] if k else 0.0
+                if k < len(curve[0]):
+                    n = min(n, int(curve[0][k]) - pos)
+
+            out[:, pos:pos + n] += synth.render_voices(pool, rows, pos, n, params)[:width]
+            pos += n
+            if pool.env_phase[slot] == ENV_OFF:
+                break
+
+        if enveloped:
+            stop = min(stop, pos)
+        # Beim Abschneiden noch hörbar (ohne Envelope reicht ein Note Off am selben Sample)?
+        if kind == KIND_MELODY and pos == cut[i] and (not enveloped or pool.env_phase[slot] != ENV_OFF):
+            carry[(ch, note)] = (pos, pool.phase[slot])
+        voice_count[start] += 1
+        voice_count[stop] -= 1
+
+    synth.bend[:] = saved_bend
+
+
+def mix_spans(synth, total, voice_count, source, crush=True):
+    # Normalisierung über die Stimmenzahl (schon aufsummiert) und Bitcrusher (crush=False:
+    # ohne), source(pos, stop) liefert das (2, n) Rohsignal
+    # Normalisierung als Tabelle über die Stimmenzahl statt pow() pro Sample
+    norm = np.ones(int(voice_count.max()) + 1)
+    norm[1:] = 1.0 / np.arange(1, len(norm)) ** 0.55
+
+    for pos in range(0, total, EXPORT_BLOCK):
+        stop = min(pos + EXPORT_BLOCK, total)
+        if not voice_count[pos:stop].any():
+            # Stille, nichts zu normalisieren
+            yield np.zeros((stop - pos, 2))
+            continue
+        block = source(pos, stop).T * norm[voice_count[pos:stop]][:, None]
+
+        # Bitcrusher
+        if crush and synth.bit_depth < 128:
+            block = np.round(block * synth.bit_depth) / synth.bit_depth
+
+        yield block
+
+
+# Version der Stems im Cache, erhöhen wenn sich der Klang der Synthese ändert
+STEM_CACHE_VERSION = 8
+DRUM_SETTINGS = (
+    "kick_vol", "kick_decay", "kick_type", "kick_noise_period",
+    "snare_vol", "snare_decay", "snare_body", "snare_type", "snare_noise_period",
+)
+
+
+class StemCache:
+    """Gerenderte Kanal-Stems auf der Platte, gelesen per Memory Map.
+
+    Ein Stem ist das Mono-Signal eines Kanals vor Panorama, Normalisierung und
+    Bitcrusher plus die Lebensdauern seiner Stimmen. Der Schlüssel enthält Song,
+    Kanaleinstellungen (ohne Pan) und Sample Rate, ändert man einen Kanal, wird
+    nur dieser neu gerendert. Werden die Dateien zu groß, fliegen die ältesten raus.
+    """
+
+    def __init__(self, directory=None, max_bytes=4 * 1024 ** 3):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "8bit-studio-stems")
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, synth, song, channel, part=None):
+        cs = {k: v for k, v in synth.channel_settings[channel].items() if k != "pan"}
+        parts = [STEM_CACHE_VERSION, song.digest(), channel, part, synth.sample_rate, synth.drum_channel,
+                 synth.oscillator, sorted(cs.items())]
+        if channel == synth.drum_channel:
+            parts.append([getattr(synth, k) for k in DRUM_SETTINGS])
+        return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
+
+    def paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".npy", base + ".count.npy"
+
+    def load(self, key):
+        audio_path, count_path = self.paths(key)
+        if not (os.path.exists(audio_path) and os.path.exists(count_path)):
+            return None
+        now = time.time()
+        os.utime(audio_path, (now, now))
+        return np.load(audio_path, mmap_mode="r"), np.load(count_path)
+
+    def render(self, key, synth, tl, select, total, params, progress=None, bends=None):
+        # Direkt in eine Memory Map rendern, erst nach Erfolg unter dem echten Namen ablegen
+        audio_path, count_path = self.paths(key)
+        tmp = audio_path + f".{os.getpid()}.tmp"
+        audio = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(1, total))
+        voice_count = np.zeros(total + 1, dtype=np.int16)
+        render_spans(synth, tl, select, total, params, audio, voice_count, progress, bends)
+        audio.flush()
+        del audio
+
+        # Lebensdauern nur als Positionen und Deltas speichern
+        changes = np.flatnonzero(voice_count)
+        np.save(count_path, np.stack([changes, voice_count[changes]]))
+        os.replace(tmp, audio_path)
+        self.prune()
+        return self.load(key)
+
+    def prune(self):
+        files = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(".npy")]
+        files = [(os.path.getmtime(f), os.path.getsize(f), f) for f in files if not f.endswith(".count.npy")]
+        used = sum(size for _, size, _ in files)
+        for _, size, f in sorted(files):
+            if used <= self.max_bytes:
+                break
+            for path in (f, f[:-len(".npy")] + ".count.npy"):
+                if os.path.exists(path):
+                    os.remove(path)
+            used -= size
+
+    def clear(self):
+        for f in os.listdir(self.directory):
+            if f.endswith(".npy"):
+                os.remove(os.path.join(self.directory, f))
+
+
+_stem_cache = None
+
+
+def default_stem_cache():
+    global _stem_cache
+    if _stem_cache is None:
+        _stem_cache = StemCache()
+    return _stem_cache
+
+
+def stem_parts(synth, tl):
+    # (Name, Kanal, Teil, Noten-Indizes) pro Stem, der Drum-Kanal wird in Kick und Snare geteilt
+    parts = []
+    for ch in np.unique(tl["channel"]).tolist():
+        select = np.flatnonzero(tl["channel"] == ch)
+        if ch == synth.drum_channel:
+            kick = tl["note"][select] < SNARE_MIN_NOTE
+            for part, mask in (("kick", kick), ("snare", ~kick)):
+                if mask.any():
+                    parts.append((part, ch, part, select[mask]))
+        else:
+            parts.append((f"ch{ch + 1:02d}", ch, None, select))
+    return parts
+
+
+def mono_params(synth):
+    # Stems werden ohne Panorama gerendert, Pan kommt erst beim Mischen dazu
+    return synth.channel_params(mono=True)
+
+
+def stem_voice_count(stems, total):
+    # Stimmenzahl aller Stems zusammen, wie sie die Normalisierung braucht
+    voice_count = np.zeros(total + 1, dtype=np.int16)
+    for audio, (changes, deltas) in stems:
+        np.add.at(voice_count, changes, deltas.astype(np.int16))
+    return np.cumsum(voice_count, out=voice_count)
+
+
+def stem_source(stems, pans):
+    # Rohsignal (2, n) als Summe der Stems mit ihren Pan-Gains
+    def source(pos, stop):
+        block = np.zeros((2, stop - pos), dtype=np.float32)
+        for (audio, _), (left, right) in zip(stems, pans):
+            mono = audio[0, pos:stop]
+            block[0] += mono * np.float32(left)
+            block[1] += mono * np.float32(right)
+        return block
+    return source
+
+
+def iter_song_stems(synth, song, progress=None, cache=None):
+    # Wie span, aber jeder Kanal (Drums getrennt nach Kick und Snare) wird als Stem gecacht.
+    # Geänderte Kanäle werden neu gerendert, der Rest ist eine Summe der Stems aus dem Cache.
+    synth.stop_stream()
+    synth.reset_state()
+    cache = cache or default_stem_cache()
+
+    sr = synth.sample_rate
+    tl = song.timeline(sr, synth.drum_channel)
+    total = song_total_samples(song, sr)
+    params = synth.channel_params()
+    mono = mono_params(synth)
+
+    parts = stem_parts(synth, tl)
+    keys = [cache.key(synth, song, ch, part) for _, ch, part, _ in parts]
+    stems = [cache.load(key) for key in keys]
+    todo = sum(len(select) for stem, (_, _, _, select) in zip(stems, parts) if stem is None)
+    done = 0
+
+    for i, (_, ch, part, select) in enumerate(parts):
+        if stems[i] is not None:
+            continue
+
+        def part_progress(fraction, done=done, n=len(select)):
+            progress((done + fraction * n) / max(1, todo))
+
+        stems[i] = cache.render(keys[i], synth, tl, select, total, mono, part_progress if progress else None,
+                                song.bend_curves(sr))
+        done += len(select)
+
+    pans = [(params["pan_left"][ch], params["pan_right"][ch]) for _, ch, _, _ in parts]
+    yield from mix_spans(synth, total, stem_voice_count(stems, total), stem_source(stems, pans))
+
+
+# Offline Engines für den Export
+ENGINES = {
+    "chunk": iter_song_chunks,
+    "span": iter_song_spans,
+    "stems": iter_song_stems,
+    "segments": iter_song_segments,
+}
+
+
+class WavStreamWriter:
+    """Schreibt Stereo-Blöcke direkt in eine WAV Datei, Speicherbedarf bleibt konstant.
+
+    normalize:
+        "peak"  - zwei Durchgänge: erst float32 schreiben und Peak merken, danach
+                  die Daten per memmap skalieren (und ggf. in-place zu int16 wandeln)
+        "fixed" - feste Verstärkung, harte Begrenzung bei 0 dBFS
+        "limit" - feste Verstärkung mit weichem tanh-Limiter
+    """
+
+    HEADER_SIZE = 44
+    PEAK_TARGET = 0.95
+
+    def __init__(self, filename, sample_rate, sample_format="int16", normalize="peak", gain=0.5):
+        if sample_format not in ("int16", "float32"):
+            raise ValueError(f"Unbekanntes Sample Format: {sample_format}")
+        if normalize not in ("peak", "fixed", "limit"):
+            raise ValueError(f"Unbekannte Normalisierung: {normalize}")
+        self.filename = filename
+        self.sample_rate = sample_rate
+        self.sample_format = sample_format
+        self.normalize = normalize
+        self.gain = gain
+        self.frames = 0
+        self.peak = 0.0
+        # Im Peak-Modus wird erstmal float32 zwischengespeichert
+        self.staging_format = "float32" if normalize == "peak" else sample_format
+        self.f = open(filename, "w+b")
+        self._write_header(self.staging_format, 0)
+
+    def _write_header(self, sample_format, frames):
+        if sample_format == "int16":
+            fmt_tag, width = 1, 2
+        else:
+            fmt_tag, width = 3, 4
+        data_bytes = frames * 2 * width
+        self.f.seek(0)
+        self.f.write(b"RIFF" + (36 + data_bytes).to_bytes(4, "little") + b"WAVE")
+        self.f.write(b"fmt " + (16).to_bytes(4, "little"))
+        self.f.write(fmt_tag.to_bytes(2, "little") + (2).to_bytes(2, "little"))
+        self.f.write(self.sample_rate.to_bytes(4, "little"))
+        self.f.write((self.sample_rate * 2 * width).to_bytes(4, "little"))
+        self.f.write((2 * width).to_bytes(2, "little") + (8 * width).to_bytes(2, "little"))
+        self.f.write(b"data" + data_bytes.to_bytes(4, "little"))
+
+    def _convert(self, stereo, sample_format):
+        if sample_format == "int16":
+            return (stereo * 32767).astype("<i2")
+        return stereo.astype("<f4")
+
+    def write(self, stereo):
+        if len(stereo) == 0:
+            return
+        self.peak = max(self.peak, float(np.max(np.abs(stereo))))
+        if self.normalize == "fixed":
+            stereo = np.clip(stereo * self.gain, -1.0, 1.0)
+        elif self.normalize == "limit":
+            stereo = np.tanh(stereo * self.gain)
+        self.f.seek(0, os.SEEK_END)
+        self.f.write(self._convert(stereo, self.staging_format).tobytes())
+        self.frames += len(stereo)
+
+    def close(self):
+        try:
+            if self.normalize == "peak" and self.frames > 0:
+                self._rescale_peak()
+            else:
+                self._write_header(self.sample_format, self.frames)
+        finally:
+            self.f.close()
+
+    def _rescale_peak(self):
+        # Zweiter Durchgang über die Datei statt über ein Array im RAM
+        scale = self.PEAK_TARGET / self.peak if self.peak > 0 else 1.0
+        self.f.flush()
+        data = np.memmap(self.f, dtype="<f4", mode="r+", offset=self.HEADER_SIZE, shape=(self.frames * 2,))
+        out = data.view("<i2") if self.sample_format == "int16" else data
+        step = EXPORT_BLOCK * 2
+        for i in range(0, len(data), step):
+            block = self._convert(data[i:i + step] * scale, self.sample_format)
+            # int16 Ziel liegt immer vor der gerade gelesenen float32 Quelle
+            out[i:i + len(block)] = block
+        data.flush()
+        del data, out
+
+        self._write_header(self.sample_format, self.frames)
+        if self.sample_format == "int16":
+            self.f.truncate(self.HEADER_SIZE + self.frames * 4)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def export_song(synth, song, filename, sample_format="int16", normalize="peak", gain=0.5, progress=None,
+                engine="chunk", jobs=None):
+    # jobs gilt nur für die segments Engine (Worker-Prozesse pro Song)
+    chunks = iter_song_segments(synth, song, progress, jobs) if engine == "segments" else ENGINES[engine](synth, song, progress)
+    with WavStreamWriter(filename, synth.sample_rate, sample_format, normalize, gain) as writer:
+        for stereo_chunk in chunks:
+            writer.write(stereo_chunk)
+    return writer.frames
+
+
+def render_file(in_path, out_path, sample_rate=None, settings=None, **export_options):
+    # Ein kompletter Headless Export, läuft auch in Worker-Prozessen
+    t0 = time.perf_counter()
+    synth = RetroSynth()
+    if settings:
+        apply_settings(synth, settings)
+    if sample_rate:
+        synth.sample_rate = sample_rate
+
+    frames = export_song(synth, Song.load(in_path), out_path, **export_options)
+
+    wall = time.perf_counter() - t0
+    duration = frames / synth.sample_rate
+    return {
+        "input": in_path,
+        "output": out_path,
+        "sample_rate": synth.sample_rate,
+        "duration": duration,
+        "wall_time": wall,
+        "realtime_factor": duration / wall if wall > 0 else None,
+    }
+
+
+def format_time(seconds):
+    mins, secs = divmod(int(seconds), 60)
+    return f"{mins}:{secs:02d}"
+
+
+def output_path_for(in_path, output, many):
+    if output and not many:
+        return output
+    name = os.path.splitext(os.path.basename(in_path))[0] + ".wav"
+    if output:
+        return os.path.join(output, name)
+    return os.path.join(os.path.dirname(in_path), name)
+
 
-        # --- SETTINGS ---
-        self.kick_vol = 1.0
-        self.kick_decay = 0.15 
-        self.kick_type = "Triangle" 
+def run_render_cli(args):
+    settings = None
+    if args.settings:
+        with open(args.settings) as f:
+            settings = json.load(f)
 
-        self.snare_vol = 0.8
-        self.snare_decay = 0.2 
-        self.snare_body = 0.5  
-        self.snare_type = "White Noise"
+    many = len(args.inputs) > 1
+    if many and args.output:
+        os.makedirs(args.output, exist_ok=True)
 
-        # --- MELODY ---
-        self.channel_settings = {
-            ch: {
-                "volume": 0.5,
-                "waveform": "Pulse",
-                "pulse_width": 0.25,
+    jobs = args.jobs or os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(args.inputs)))
+    failed = 0
 
-                # Extra erweiterte modi weil cool
-                "pan": 0.0, # -1 = links, 0 = mitte, +1 = rechts
+    export_options = {
+        "sample_format": args.format,
+        "normalize": args.normalize,
+        "gain": args.gain,
+        "engine": args.engine,
+    }
 
-                "env_enabled": False,
-                "attack": 0.01,
-                "decay": 0.1,
-                "sustain": 0.7,
-                "release": 0.2,
+    if args.engine == "segments":
+        # Die Worker teilen sich die Segmente eines Songs, die Dateien laufen nacheinander
+        export_options["jobs"] = args.jobs
+        for path in args.inputs:
+            try:
+                summary = render_file(path, output_path_for(path, args.output, many), args.rate, settings,
+                                      **export_options)
+            except Exception as e:
+                failed += 1
+                summary = {"input": path, "error": str(e)}
+            print(json.dumps(summary), flush=True)
+        return 1 if failed else 0
 
-                "pw_enabled": False,
-                "pw_start": 0.25,
-                "pw_stop": 0.5,
-                "pw_bounce": False,
-                "pw_bounce_time": 0.2,
-            }
-            for ch in range(16)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(render_file, path, output_path_for(path, args.output, many), args.rate, settings, **export_options): path
+            for path in args.inputs
         }
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as e:
+                failed += 1
+                summary = {"input": futures[future], "error": str(e)}
+            # Eine JSON Zeile pro Datei, damit Skripte das Ergebnis parsen können
+            print(json.dumps(summary), flush=True)
 
-        self.current_sample_index = 0
-        self.stream = None
+    return 1 if failed else 0
 
-    def get_freq(self, midi_note):
-        return 440.0 * (2.0 ** ((midi_note - 69) / 12.0))
 
-    def reset_state(self):
-        with self.lock:
-            self.active_notes.clear()
-            self.current_sample_index = 0
-            for i in range(16):
-                self.note_activity_callback(i, False)
+def current_settings(synth):
+    # Gegenstück zu apply_settings, z.B. um den aktuellen Zustand an Worker-Prozesse zu geben
+    settings = {key: getattr(synth, key) for key in SYNTH_SETTINGS}
+    settings["channels"] = {str(ch): dict(cs) for ch, cs in synth.channel_settings.items()}
+    return settings
 
-    def generate_chunk(self, frames, current_time_index):
-        if frames <= 0: return np.array([])
 
-        global_t = (np.arange(frames) + current_time_index) / self.sample_rate
-        mix_left = np.zeros(frames)
-        mix_right = np.zeros(frames)
-        
-        # Polyphonie Limitierung (Safe Copy)
-        if len(self.active_notes) > self.max_polyphony:
-            try:
-                # Wir sortieren eine Kopie, um Thread-Crashs zu vermeiden
-                current_notes = list(self.active_notes.items())
-                sorted_notes = sorted(current_notes, key=lambda item: item[1]['start_time'], reverse=True)
-                with self.lock:
-                    self.active_notes = dict(sorted_notes[:self.max_polyphony])
-            except: pass
+def render_stem_job(in_path, settings, channel, part, stem_dir):
+    # Worker: einen Stem in den (gemeinsamen) Stem Cache auf der Platte rendern
+    synth = RetroSynth()
+    apply_settings(synth, settings)
+    song = Song.load(in_path)
+    cache = StemCache(stem_dir)
+    tl = song.timeline(synth.sample_rate, synth.drum_channel)
+    for name, ch, p, select in stem_parts(synth, tl):
+        if (ch, p) == (channel, part):
+            key = cache.key(synth, song, ch, p)
+            if cache.load(key) is None:
+                cache.render(key, synth, tl, select, song_total_samples(song, synth.sample_rate), mono_params(synth),
+                             bends=song.bend_curves(synth.sample_rate))
+            return name
+    raise ValueError(f"Kein Stem für Kanal {channel + 1} ({part})")
 
-        # WICHTIG: Note Count merken für Normalisierung
-        note_count = len(self.active_notes)
-        
-        # SUPER WICHTIG: Iteration über eine Kopie der Liste
-        # Das verhindert "RuntimeError: dictionary changed size"
-        safe_notes_list = list(self.active_notes.items())
-
-        for note, data in safe_notes_list:
-            freq = data['freq']
-            sound_type = data['type']
-            start_sample = data['start_time']
-            
-            # Zeit relativ zum Start der Note
-            note_t = global_t - (start_sample / self.sample_rate)
-            
-            # Negative Zeiten (Note startet mitten im Chunk) abfangen
-            # np.maximum verhindert NaN oder Fehler bei exp
-            note_t = np.maximum(0, note_t)
-
-            wave_data = np.zeros(frames)
-            
-            # --- KICK ---
-            if sound_type == 'kick':
-                env = np.exp(-note_t * (1.0 / max(0.01, self.kick_decay)))
-                phase = (global_t * freq) % 1.0
-                
-                if self.kick_type == "Triangle":
-                    raw = 2.0 * np.abs(2.0 * (phase - np.floor(phase + 0.5))) - 1.0
-                elif self.kick_type == "Sine":
-                    raw = np.sin(2 * np.pi * freq * global_t)
-                elif self.kick_type == "Pulse":
-                    raw = np.sign(np.sin(2 * np.pi * freq * global_t))
-                elif self.kick_type == "Noise":
-                    raw = np.random.uniform(-1, 1, frames)
-                else:
-                    raw = np.zeros(frames)
-                wave_data = raw * env * self.kick_vol * 2.0 
-
-            # --- SNARE ---
-            elif sound_type == 'snare':
-                env_noise = np.exp(-note_t * (1.0 / max(0.01, self.snare_decay)))
-                
-                if self.snare_type == "White Noise":
-                    noise = np.random.uniform(-1, 1, frames)
-                elif self.snare_type == "Digital":
-                    noise = np.random.choice([-1, 1], size=frames)
-                else: 
-                    mod = np.sin(2 * np.pi * (freq * 4.5) * global_t)
-                    noise = np.random.uniform(-1, 1, frames) * mod
-                
-                noise_part = noise * env_noise
-                
-                # Body/Punch
-                body_freq = 180.0 
-                env_body = np.exp(-note_t * 15.0) 
-                body_part = np.sin(2 * np.pi * body_freq * global_t) * env_body
-
-                wave_data = (noise_part * (1.0 - (self.snare_body * 0.4))) + (body_part * self.snare_body * 2.0)
-                wave_data *= self.snare_vol
-
-            # --- MELODY ---
-            elif sound_type == 'melody':
-                ch = data.get("channel", 0)
-                cs = self.channel_settings.get(ch, self.channel_settings[0])
-
-                phase = (global_t * freq) % 1.0
-
-                # Envelope anpassung
-                if cs["env_enabled"]:
-                    a = cs["attack"]
-                    d = cs["decay"]
-                    s = cs["sustain"]
-                    r = cs["release"]
-
-                    env = np.zeros(frames)
-                    for i in range(frames):
-                        dt = 1.0 / self.sample_rate
-
-                        if data['env_phase'] == 'attack':
-                            data['env_level'] += dt / max(0.001, a)
-                            if data['env_level'] >= 1.0:
-                                data['env_level'] = 1.0
-                                data['env_phase'] = 'decay'
-
-                        elif data['env_phase'] == 'decay':
-                            data['env_level'] -= dt * (1.0 - s) / max(0.001, d)
-                            if data['env_level'] <= s:
-                                data['env_level'] = s
-                                data['env_phase'] = 'sustain'
-
-                        elif data['env_phase'] == 'sustain':
-                            data['env_level'] = s
-
-                        env[i] = data['env_level']
 
-                else:
-                    env = np.ones(frames)
-
-                # Pulsbreitenanpassung
-                pw = cs["pulse_width"]
-
-                if cs["pw_enabled"]:
-                    if cs["pw_bounce"]:
-                        # Zwichen start und stop über zeit welchseln
-                        T = max(0.001, cs["pw_bounce_time"])
-                        cycle = (global_t / T) % 2.0
-                        cycle = np.where(cycle > 1.0, 2.0 - cycle, cycle)
-                        pw = cs["pw_start"] + cycle * (cs["pw_stop"] - cs["pw_start"])
-                    else:
-                        # Linearverlauf
-                        note_duration = max(0.001, np.max(note_t))  # division durch 0 verhindern
-                        pct = np.clip(note_t / note_duration, 0.0, 1.0)
-                        pw = cs["pw_start"] + pct * (cs["pw_stop"] - cs["pw_start"])
-
-                if cs["waveform"] == "Pulse":
-                    wave_data = np.where(phase < pw, 1.0, -1.0)
-                elif cs["waveform"] == "Triangle":
-                    wave_data = 2.0 * np.abs(2.0 * (phase - np.floor(phase + 0.5))) - 1.0
-                else:  # Sawtooth
-                    wave_data = 2.0 * (phase - 0.5)
-
-                wave_data *= cs["volume"]
-                wave_data *= env
-
-            # Seitenabgleich
-            left_gain = np.cos((cs["pan"] + 1) * np.pi/4)
-            right_gain = np.sin((cs["pan"] + 1) * np.pi/4)
-
-            mix_left  += wave_data * left_gain * data['vel']
-            mix_right += wave_data * right_gain * data['vel']
+def export_stems(in_path, out_dir, settings=None, sample_rate=None, jobs=None, sample_format="int16",
+                 normalize="fixed", gain=0.5, mixdown=False, stem_dir=None, progress=None, crush_stems=False):
+    """Eine WAV Datei pro MIDI Kanal (Drums getrennt nach Kick und Snare), optional plus Mixdown.
 
-        # Normalisierung
-        if note_count > 0:
-            mix_left = mix_left / (note_count ** 0.55)
-            mix_right = mix_right / (note_count ** 0.55)
+    Die Stems werden parallel in Worker-Prozessen gerendert (über den Stem Cache), danach
+    mit der Normalisierung des kompletten Songs geschrieben. Der Bitcrusher gilt nur für
+    den Mixdown, summiert man die Stems, ergibt das also den Mix vor dem Bitcrusher.
+    crush_stems schickt jeden Stem einzeln durch den Bitcrusher (klingt wie der Kanal solo,
+    die Summe ist dann nicht mehr der Mix). Pro Stem wird Peak und RMS zurückgegeben.
+    """
+    t0 = time.perf_counter()
+    synth = RetroSynth()
+    if settings:
+        apply_settings(synth, settings)
+    if sample_rate:
+        synth.sample_rate = sample_rate
+    settings = current_settings(synth)
 
-        # Bitcrusher
-        if self.bit_depth < 128:
-            mix_left = np.round(mix_left * self.bit_depth) / self.bit_depth
-            mix_right = np.round(mix_right * self.bit_depth) / self.bit_depth
+    song = Song.load(in_path)
+    sr = synth.sample_rate
+    tl = song.timeline(sr, synth.drum_channel)
+    total = song_total_samples(song, sr)
+    cache = StemCache(stem_dir) if stem_dir else default_stem_cache()
+    parts = stem_parts(synth, tl)
+    keys = [cache.key(synth, song, ch, part) for _, ch, part, _ in parts]
+    missing = [(ch, part) for key, (_, ch, part, _) in zip(keys, parts) if cache.load(key) is None]
 
-        return mix_left, mix_right
+    # Kanäle sind unabhängig, jeder fehlende Stem ist ein eigener Job
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(missing)))
+    done = len(parts) - len(missing)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(render_stem_job, in_path, settings, ch, part, cache.directory) for ch, part in missing]
+            for future in as_completed(futures):
+                future.result()
+                done += 1
+                if progress: progress(done / (len(parts) + 1))
+    else:
+        for ch, part in missing:
+            render_stem_job(in_path, settings, ch, part, cache.directory)
+            done += 1
+            if progress: progress(done / (len(parts) + 1))
 
-    def audio_callback(self, outdata, frames, time_info, status):
-        if status: print(status)
-        try:
-            # Live Playback ist fehlertolerant
-            mix_left, mix_right = self.generate_chunk(frames, self.current_sample_index)
-            self.current_sample_index += frames
-            outdata[:] = np.column_stack([mix_left, mix_right])
-        except Exception:
-            # Im Zweifel Stille ausgeben statt abstürzen
-            outdata[:] = np.zeros((frames, 2))
+    stems = [cache.load(key) for key in keys]
+    voice_count = stem_voice_count(stems, total)
+    params = synth.channel_params()
+    pans = [(params["pan_left"][ch], params["pan_right"][ch]) for _, ch, _, _ in parts]
+    base = os.path.splitext(os.path.basename(in_path))[0]
+    os.makedirs(out_dir, exist_ok=True)
 
-    def start_stream(self):
-        self.stop_stream()
-        self.stream = sd.OutputStream(channels=2, samplerate=self.sample_rate, callback=self.audio_callback)
-        self.stream.start()
+    def write(path, source, crush):
+        # Schreibt einen Stem/Mix und misst dabei Peak und RMS des Signals
+        sumsq = 0.0
+        with WavStreamWriter(path, sr, sample_format, normalize, gain) as writer:
+            for block in mix_spans(synth, total, voice_count, source, crush):
+                writer.write(block)
+                sumsq += float(np.sum(np.square(block, dtype=np.float64)))
+        peak = writer.peak
+        rms = np.sqrt(sumsq / max(1, 2 * writer.frames))
+        if normalize == "peak":
+            scale = WavStreamWriter.PEAK_TARGET / peak if peak > 0 else 1.0
+        else:
+            scale = gain
+        return {
+            "output": path,
+            "peak": peak,
+            "rms": rms,
+            # Pegel in der Datei, bei fixed/limit also inkl. --gain (vor Clipping/Limiter)
+            "peak_dbfs": 20 * np.log10(peak * scale) if peak > 0 else None,
+            "rms_dbfs": 20 * np.log10(rms * scale) if rms > 0 else None,
+        }
 
-    def stop_stream(self):
-        if self.stream:
-            try:
-                self.stream.stop()
-                self.stream.close()
-            except: pass
-            self.stream = None
+    results = []
+    for (name, ch, part, _), stem, pan in zip(parts, stems, pans):
+        info = write(os.path.join(out_dir, f"{base}_{name}.wav"), stem_source([stem], [pan]), crush_stems)
+        results.append(dict(name=name, channel=ch + 1, **info))
 
-    def note_on(self, note, velocity, channel):
-        vol = velocity / 127.0
-        if channel == self.drum_channel: 
-            if note < 38: s_type = 'kick' 
-            else: s_type = 'snare' 
+    summary = {"input": in_path, "sample_rate": sr, "stems": results}
+    if mixdown:
+        summary["mixdown"] = write(os.path.join(out_dir, f"{base}_mix.wav"), stem_source(stems, pans), True)
+    if progress: progress(1.0)
+
+    summary["wall_time"] = time.perf_counter() - t0
+    return summary
+
+
+def run_stems_cli(args):
+    settings = None
+    if args.settings:
+        with open(args.settings) as f:
+            settings = json.load(f)
+    out_dir = args.output or os.path.splitext(args.input)[0] + "_stems"
+    try:
+        summary = export_stems(args.input, out_dir, settings, args.rate, args.jobs, args.format, args.normalize,
+                               args.gain, args.mixdown, crush_stems=args.crush_stems)
+    except Exception as e:
+        print(json.dumps({"input": args.input, "error": str(e)}))
+        return 1
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+def run_live_cli(args):
+    synth = RetroSynth()
+    if args.settings:
+        load_settings(synth, args.settings)
+    if args.rate:
+        synth.sample_rate = args.rate
+    synth.block_size = args.block
+    if args.list:
+        for i, name in enumerate(LiveInput.ports()):
+            print(f"{i}: {name}")
+        return 0
+    port = int(args.port) if args.port and args.port.isdigit() else args.port
+    try:
+        live = LiveInput(synth, port)
+        name = live.start()
+    except Exception as e:
+        print(json.dumps({"error": str(e)}))
+        return 1
+    print(f"Live: {name} | {synth.sample_rate} Hz, Block {synth.block_size} (Strg+C zum Beenden)", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(1.0)
+            live.update_latency()
+            m = synth.metrics
+            if m.input_latencies:
+                print(f"Latenz {1000 * m.input_latency:.1f} ms (Schnitt {1000 * m.input_latency_total / m.input_latencies:.1f}, "
+                      f"max {1000 * m.input_latency_max:.1f}) | DSP {100 * m.load:.0f}% | XRUN {m.underruns + m.overruns}",
+                      file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        live.stop()
+    print(json.dumps(synth.metrics.as_dict(), indent=2))
+    return 0
+
+
+# Render Daemon: Worker-Prozesse bleiben warm (Imports, Synth, Puffer, Drum Cache),
+# Jobs kommen als HTTP über localhost oder einen UNIX Socket
+_daemon_synth = None
+_daemon_defaults = None
+
+# Engines, die im Daemon erlaubt sind (segments würde Worker in Workern starten)
+DAEMON_ENGINES = ("chunk", "span", "stems")
+
+
+def daemon_worker_init():
+    global _daemon_synth, _daemon_defaults
+    _daemon_synth = RetroSynth()
+    _daemon_defaults = current_settings(_daemon_synth)
+    # Einmal kurz rendern, damit Puffer und Caches vor dem ersten Job stehen
+    for _ in iter_song_chunks(_daemon_synth, Song(synthetic_midi(2, 8.0, 4.0, 0.5))):
+        pass
+
+
+def daemon_render_job(job, path):
+    # Worker: Job mit dem warmen Synth nach path rendern. Jeder Job startet von den
+    # Default-Einstellungen, Patches früherer Jobs bleiben nicht hängen
+    synth = _daemon_synth
+    apply_settings(synth, _daemon_defaults)
+    apply_settings(synth, job["settings"])
+    try:
+        if job.get("data") is not None:
+            song = Song(mido.MidiFile(file=io.BytesIO(job["data"])))
         else:
-            s_type = 'melody'
+            song = Song.load(job["path"])
+    except (OSError, EOFError, KeyError) as e:
+        # mido meldet kaputte Dateien oft ohne Text
+        raise ValueError(f"Ungültige MIDI Datei ({type(e).__name__}: {e})")
+    t0 = time.perf_counter()
+    frames = export_song(synth, song, path, **job["options"])
+    return {"frames": frames, "duration": frames / synth.sample_rate, "render_time": time.perf_counter() - t0}
+
+
+def parse_render_job(payload, data=None):
+    # payload: JSON Objekt bzw. Query Parameter. MIDI kommt als data (Rohdaten im Body),
+    # "midi" (base64) oder "path" (Datei auf dem Server)
+    if not isinstance(payload, dict):
+        raise ValueError("Job muss ein JSON Objekt sein")
+    settings = payload.get("settings") or {}
+    if not isinstance(settings, dict):
+        raise ValueError("settings muss ein JSON Objekt sein")
+    settings = dict(settings)
+
+    def number(key, default, convert):
+        # Query Parameter kommen als Text, JSON Werte bleiben wie sie sind
+        value = payload.get(key, default)
+        if isinstance(value, str):
+            try:
+                value = convert(value)
+            except ValueError:
+                raise ValueError(f"{key} muss eine Zahl sein, nicht {value!r}")
+        return value
 
+    if payload.get("rate"):
+        settings["sample_rate"] = number("rate", None, int)
+    # Einstellungen schon hier an einem frischen Synth prüfen (Typen und Wertebereiche, siehe
+    # SETTING_RANGES), Fehler gehen so als 400 an den Client, bevor ein Worker den Job bekommt
+    try:
+        apply_settings(RetroSynth(), settings)
+    except (TypeError, KeyError) as e:
+        raise ValueError(f"Ungültige Einstellungen: {e}")
+    options = {
+        "sample_format": payload.get("format", "int16"),
+        "normalize": payload.get("normalize", "peak"),
+        "gain": check_number("gain", number("gain", 0.5, float), 0, 10),
+        "engine": payload.get("engine", "chunk"),
+    }
+    if options["sample_format"] not in ("int16", "float32"):
+        raise ValueError(f"Unbekanntes Sample Format: {options['sample_format']}")
+    if options["normalize"] not in ("peak", "fixed", "limit"):
+        raise ValueError(f"Unbekannte Normalisierung: {options['normalize']}")
+    if options["engine"] not in DAEMON_ENGINES:
+        raise ValueError(f"Engine nicht erlaubt: {options['engine']}")
+
+    if data is None and payload.get("midi"):
+        if not isinstance(payload["midi"], str):
+            raise ValueError("midi muss base64 Text sein")
+        data = base64.b64decode(payload["midi"])
+    job = {"data": data, "path": None, "settings": settings, "options": options}
+    if data is None:
+        if not payload.get("path"):
+            raise ValueError("Job braucht MIDI Daten oder einen Pfad")
+        if not isinstance(payload["path"], str):
+            raise ValueError("path muss ein Text sein")
+        job["path"] = os.path.abspath(payload["path"])
+        if not os.path.isfile(job["path"]):
+            raise ValueError(f"MIDI Datei nicht gefunden: {payload['path']}")
+    return job
+
+
+def render_job_key(job):
+    # Gleiche MIDI Daten + gleiche Einstellungen = gleicher Job. Dateien zählen über
+    # Pfad, Größe und Änderungszeit
+    h = hashlib.sha1()
+    if job["data"] is not None:
+        h.update(job["data"])
+    else:
+        st = os.stat(job["path"])
+        h.update(f"{job['path']}:{st.st_size}:{st.st_mtime_ns}".encode())
+    h.update(json.dumps([job["settings"], job["options"]], sort_keys=True).encode())
+    return h.hexdigest()
+
+
+class RenderDaemon:
+    """Warmer Worker Pool für Render Jobs mit Deduplizierung laufender Jobs.
+
+    Ein Job, der schon läuft (oder dessen WAV noch gestreamt wird), wird nicht noch
+    einmal gerendert, alle Anfragen bekommen dieselbe Datei. Die Datei wird gelöscht,
+    sobald die letzte Anfrage sie fertig gelesen hat.
+    """
+
+    def __init__(self, jobs=None):
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+        self.pool = ProcessPoolExecutor(max_workers=self.jobs, initializer=daemon_worker_init)
+        self.work_dir = tempfile.mkdtemp(prefix="8bit-daemon-")
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.started = time.perf_counter()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self.audio_seconds = 0.0
+        self.render_seconds = 0.0
+
+    def submit(self, job):
+        # Liefert (Eintrag, dedupliziert). Jeder Eintrag muss mit release() zurückgegeben werden
+        key = render_job_key(job)
         with self.lock:
-            self.active_notes[note] = {
-                'channel': channel,
-                'freq': self.get_freq(note),
-                'vel': vol,
-                'start_time': self.current_sample_index,
-                'type': s_type,
-
-                # Envelope parameter
-                'env_phase': "attack",
-                'env_level': 0.0,
-
-                # Plusbreitenautomatisierung
-                'pw_val': self.channel_settings[channel]["pulse_width"],
-                'pw_direction': 1, # nur beim bounce an
-            }
-        if self.note_activity_callback:
-            self.note_activity_callback(channel, True)
-
-    def note_off(self, note):
-        channel = self.active_notes[note]['channel'] if note in self.active_notes else None
-        if note in self.active_notes:
-            if self.active_notes[note]['type'] == 'melody' and self.active_notes[note]['env_phase'] == "attack":
-                del self.active_notes[note]
-        if self.note_activity_callback and channel is not None:
-            still_active = any(n['channel']==channel for n in self.active_notes.values())
-            self.note_activity_callback(channel, still_active)
+            entry = self.inflight.get(key)
+            if entry is not None:
+                entry["users"] += 1
+                self.deduplicated += 1
+                return entry, True
+            path = os.path.join(self.work_dir, f"{key}.wav")
+            entry = {"key": key, "path": path, "users": 1}
+            self.inflight[key] = entry
+            self.submitted += 1
+            entry["future"] = self.pool.submit(daemon_render_job, job, path)
+        entry["future"].add_done_callback(self._finished)
+        return entry, False
 
-    def all_notes_off(self):
+    def _finished(self, future):
+        with self.lock:
+            # Abgebrochen (Pool beim Beenden) zählt wie ein Fehler
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+                return
+            result = future.result()
+            self.completed += 1
+            self.audio_seconds += result["duration"]
+            self.render_seconds += result["render_time"]
+
+    def release(self, entry):
+        with self.lock:
+            entry["users"] -= 1
+            if entry["users"] > 0:
+                return
+            self.inflight.pop(entry["key"], None)
+        if os.path.exists(entry["path"]):
+            os.remove(entry["path"])
+
+    def stats(self):
         with self.lock:
-            self.active_notes.clear()
+            pending = self.submitted - self.completed - self.failed
+            uptime = time.perf_counter() - self.started
+            return {
+                "workers": self.jobs,
+                "queue_depth": max(0, pending - self.jobs),
+                "running": min(pending, self.jobs),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "deduplicated": self.deduplicated,
+                "uptime": uptime,
+                "jobs_per_second": self.completed / uptime if uptime > 0 else 0.0,
+                "audio_seconds": self.audio_seconds,
+                # Gerenderte Audiosekunden pro Sekunde Rechenzeit (über alle Worker)
+                "realtime_factor": self.audio_seconds / self.render_seconds if self.render_seconds > 0 else None,
+            }
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """POST /render: MIDI (Body) oder JSON Job -> WAV, GET /stats: Warteschlange und Durchsatz."""
+
+    STREAM_BLOCK = 1 << 16
+
+    def address_string(self):
+        # Beim UNIX Socket gibt es keine Client Adresse
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urllib.parse.urlparse(self.path).path == "/stats":
+            self.send_json(200, self.server.render_daemon.stats())
+        else:
+            self.send_json(404, {"error": "Unbekannter Pfad"})
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != "/render":
+            self.send_json(404, {"error": "Unbekannter Pfad"})
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                job = parse_render_job(json.loads(body))
+            else:
+                # Rohes MIDI im Body, Optionen als Query, settings als JSON String
+                query = dict(urllib.parse.parse_qsl(url.query))
+                if "settings" in query:
+                    query["settings"] = json.loads(query["settings"])
+                job = parse_render_job(query, body)
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        daemon = self.server.render_daemon
+        entry, shared = daemon.submit(job)
+        try:
+            try:
+                result = entry["future"].result()
+            except ValueError as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            except CancelledError:
+                self.send_json(503, {"error": "Server wird beendet"})
+                return
+            except Exception as e:
+                self.send_json(500, {"error": str(e)})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/wav")
+            self.send_header("Content-Length", str(os.path.getsize(entry["path"])))
+            self.send_header("X-Render-Time", f"{result['render_time']:.4f}")
+            self.send_header("X-Deduplicated", "1" if shared else "0")
+            self.end_headers()
+            with open(entry["path"], "rb") as f:
+                while True:
+                    block = f.read(self.STREAM_BLOCK)
+                    if not block:
+                        break
+                    self.wfile.write(block)
+        finally:
+            daemon.release(entry)
+
+
+class RenderHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class RenderUnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def run_serve_cli(args):
+    daemon = RenderDaemon(args.jobs)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = RenderUnixServer(args.socket, RenderRequestHandler)
+        address = f"unix:{args.socket}"
+    else:
+        server = RenderHTTPServer(("127.0.0.1", args.port), RenderRequestHandler)
+        address = f"http://127.0.0.1:{server.server_address[1]}"
+    server.render_daemon = daemon
+    # SIGTERM (z.B. vom Service Manager) beendet genauso sauber wie Strg+C
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+    print(json.dumps({"listening": address, "workers": daemon.jobs}), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+
+def benchmark_envelope(voices=16, frames=512, blocks=200, sample_rate=44100):
+    # Vergleicht die Block-Envelope aller Stimmen mit der alten Sample-Schleife pro Stimme
+    synth = RetroSynth()
+    synth.sample_rate = sample_rate
+    cs = synth.channel_settings[0]
+    cs.update(env_enabled=True, attack=0.05, decay=0.1, sustain=0.6, release=0.2)
+    params = synth.publish_patch()
+    release_block = blocks // 2
+
+    pool = VoicePool(voices)
+    for v in range(voices):
+        synth.add_voice(pool, 60 + v, 100, 0, False, 0)
+    rows = np.arange(voices)
+    out = []
+    t0 = time.perf_counter()
+    for b in range(blocks):
+        if b == release_block:
+            for slot in rows:
+                synth.release_slot(pool, slot)
+        out.append(synth.render_envelopes(pool, rows, pool.channel[rows], params, frames).copy())
+    t_block = time.perf_counter() - t0
+    env_block = np.concatenate(out, axis=1)
+
+    states = [{'env_phase': 'attack', 'env_level': 0.0, 'release_level': 0.0} for _ in range(voices)]
+    out = []
+    t0 = time.perf_counter()
+    for b in range(blocks):
+        for data in states:
+            if b == release_block:
+                data['release_level'] = data['env_level']
+                data['env_phase'] = 'release'
+        out.append(np.stack([synth._render_envelope_reference(data, cs, frames) for data in states]))
+    t_loop = time.perf_counter() - t0
+    env_loop = np.concatenate(out, axis=1)
+
+    calls = voices * blocks
+    return {
+        "voices": voices,
+        "frames": frames,
+        "blocks": blocks,
+        "sample_rate": sample_rate,
+        "block_us_per_voice": t_block / calls * 1e6,
+        "loop_us_per_voice": t_loop / calls * 1e6,
+        "speedup": t_loop / t_block if t_block > 0 else float("inf"),
+        "max_abs_diff": float(np.max(np.abs(env_block - env_loop))),
+    }
+
+
+# Synthetische Songs für den Benchmark: melodische Kanäle, Noten/s, Drum-Hits/s, Kanal-Patch
+BENCH_WORKLOADS = {
+    "sparse": {"channels": 2, "density": 4.0, "drums": 2.0, "patch": "plain"},
+    "dense": {"channels": 8, "density": 40.0, "drums": 8.0, "patch": "mix"},
+    "poly": {"channels": 15, "density": 12.0, "drums": 4.0, "patch": "env"},
+    "automation": {"channels": 6, "density": 16.0, "drums": 4.0, "patch": "full"},
+}
+BENCH_PATCHES = ("plain", "mix", "env", "full")
+
+
+def bench_patch(synth, patch):
+    # mix = Wellenformen über die Kanäle verteilt, env = Envelope an, full = alles inkl. PW Automation
+    for ch, cs in synth.channel_settings.items():
+        if patch in ("mix", "full"):
+            cs["waveform"] = WAVEFORMS[ch % len(WAVEFORMS)]
+        if patch in ("env", "full"):
+            cs.update(env_enabled=True, attack=0.01, decay=0.1, sustain=0.6, release=0.15)
+        if patch == "full":
+            cs.update(pw_enabled=True, pw_bounce=ch % 2 == 0)
+    synth.publish_patch()
+
+
+def synthetic_midi(channels=4, density=10.0, drums=4.0, seconds=10.0, seed=0, zero_length=0.0, tail=0.0):
+    """Erzeugt einen reproduzierbaren Song im Speicher (mido.MidiFile, 120 BPM).
+
+    density Noten pro Sekunde über alle melodischen Kanäle, drums Hits pro Sekunde auf
+    Kanal 10. Startzeiten sind nicht quantisiert, damit die Event-Dichte realistisch ist.
+    zero_length: Anteil der melodischen Noten, deren Off auf dem Tick ihres Ons liegt.
+    tail: Pause in Sekunden nach dem letzten Event (end_of_track).
+    """
+    rng = np.random.default_rng(seed)
+    ticks_per_sec = 960  # 480 ppq bei 120 BPM
+    melodic = [ch for ch in range(16) if ch != 9][:channels]
+    events = []
+
+    # Reihenfolge auf demselben Tick: Note Offs, Note Ons, dann die Offs der Noten mit Länge 0
+    def add(ch, note, start, length, velocity):
+        on = int(start * ticks_per_sec)
+        events.append((on, 1, ch, note, velocity))
+        if length == 0:
+            events.append((on, 2, ch, note, 0))
+        else:
+            events.append((on + max(1, int(length * ticks_per_sec)), 0, ch, note, 0))
+
+    for _ in range(rng.poisson(density * seconds)):
+        add(int(rng.choice(melodic)), int(rng.integers(36, 85)), rng.uniform(0, seconds),
+            rng.uniform(0.05, 0.5), int(rng.integers(60, 128)))
+    if zero_length:
+        for _ in range(rng.poisson(zero_length * density * seconds)):
+            add(int(rng.choice(melodic)), int(rng.integers(36, 85)), rng.uniform(0, seconds), 0,
+                int(rng.integers(60, 128)))
+    for _ in range(rng.poisson(drums * seconds)):
+        add(9, int(rng.choice([36, 38])), rng.uniform(0, seconds), 0.05, int(rng.integers(80, 128)))
+
+    events.sort(key=lambda e: (e[0], e[1]))
+    mid = mido.MidiFile(ticks_per_beat=480)
+    track = mido.MidiTrack()
+    mid.tracks.append(track)
+    last = 0
+    for tick, order, ch, note, velocity in events:
+        kind = "note_on" if order == 1 else "note_off"
+        track.append(mido.Message(kind, channel=ch, note=note, velocity=velocity, time=tick - last))
+        last = tick
+    if tail:
+        track.append(mido.MetaMessage("end_of_track", time=int(tail * ticks_per_sec)))
+    return mid
+
+
+def bench_voices(synth, voices):
+    # Frischer Zustand mit voices klingenden Stimmen (inkl. zwei Drums)
+    synth.reset_state()
+    for v in range(voices):
+        if v < 2 and voices > 2:
+            synth.note_on(36 + 2 * v, 100, 9)
+        else:
+            synth.note_on(48 + v, 100, v % 8)
+
+
+def benchmark_chunk(voices=16, frames=512, sample_rate=44100, patch="plain", blocks=200, repeat=3, kernel="numpy"):
+    # generate_chunk mit einer festen Anzahl klingender Stimmen (inkl. zwei Drums)
+    synth = RetroSynth()
+    synth.sample_rate = sample_rate
+    synth.max_polyphony = max(synth.max_polyphony, voices)
+    synth.kernel = kernel
+    bench_patch(synth, patch)
+
+    def setup():
+        bench_voices(synth, voices)
+
+    best = float("inf")
+    for _ in range(repeat):
+        setup()
+        t0 = time.perf_counter()
+        for b in range(blocks):
+            synth.generate_chunk(frames, b * frames)
+        best = min(best, time.perf_counter() - t0)
+
+    per_block = best / blocks
+    return {
+        "bench": "chunk",
+        "voices": voices,
+        "frames": frames,
+        "sample_rate": sample_rate,
+        "patch": patch,
+        "kernel": kernel,
+        "us_per_block": per_block * 1e6,
+        "dsp_load_percent": 100.0 * per_block * sample_rate / frames,
+    }
+
+
+# Maximale Abweichung eines Backends von der NumPy Referenz
+KERNEL_TOLERANCE = 1e-6
+
+
+def benchmark_kernel(kernel, voices=16, frames=512, sample_rate=44100, blocks=40):
+    # Äquivalenz eines Backends (KERNELS oder REFERENCE_KERNELS) mit der NumPy Referenz über
+    # alle Bench-Patches und Oszillatoren, mit Pitch Bend und Vibrato auf je einem Kanal, Note
+    # Offs in der Mitte (Release) und Blockgrößen, die nicht aufgehen
+    worst = 0.0
+    for patch in BENCH_PATCHES:
+        for oscillator in OSCILLATORS:
+            blocks_out = []
+            for name in ("numpy", kernel):
+                synth = RetroSynth()
+                synth.sample_rate = sample_rate
+                synth.max_polyphony = max(synth.max_polyphony, voices)
+                synth.kernel = name
+                synth.oscillator = oscillator
+                bench_patch(synth, patch)
+                synth.set_channel(3, "vibrato_depth", 0.5)
+                if name != "numpy" and synth.patch["kernel"] is KERNELS["numpy"]:
+                    raise ValueError(f"Unbekannter Kernel: {name}")
+                bench_voices(synth, voices)
+                synth.pitch_bend(1, 4096)
+                out, pos = [], 0
+                for b in range(blocks):
+                    if b == blocks // 2:
+                        for v in range(2, voices, 2):
+                            synth.note_off(48 + v, v % 8)
+                    n = frames - 7 * (b % 3)
+                    out.append(np.array(synth.generate_chunk(n, pos)))
+                    pos += n
+                blocks_out.append(np.concatenate(out, axis=1))
+            worst = max(worst, float(np.max(np.abs(blocks_out[1] - blocks_out[0]))))
+
+    timing = {name: benchmark_chunk(voices, frames, sample_rate, "full", blocks, kernel=name)["us_per_block"]
+              for name in ("numpy", kernel)}
+    return {
+        "bench": "kernel",
+        "kernel": kernel,
+        "voices": voices,
+        "frames": frames,
+        "sample_rate": sample_rate,
+        "us_per_block": timing[kernel],
+        "speedup": timing["numpy"] / timing[kernel] if timing[kernel] > 0 else None,
+        "max_abs_diff": worst,
+        "equivalent": worst <= KERNEL_TOLERANCE,
+    }
+
+
+# Erlaubte Spitze pro Block im Audio Callback: kleine Index-Arrays und Python Objekte, ein
+# wenig pro Stimme, aber nichts, was mit der Blockgröße wächst
+ALLOC_BUDGET_BYTES = 16 * 1024
+ALLOC_BUDGET_PER_VOICE = 128
+
+
+def benchmark_allocations(voices=16, frames=512, sample_rate=44100, patch="full", blocks=100, oscillator="naive"):
+    # Speicher, den der Audio Callback im eingeschwungenen Zustand anlegt (tracemalloc).
+    # Gemessen wird die Spitze über alle Blöcke. Arbeitspuffer in Blockgröße gibt es nicht
+    # mehr, und NumPy rechnet mit kleinen Iterationspuffern (RENDER_BUFSIZE). Der Callback
+    # gilt als allokationsfrei, solange die Spitze unter ALLOC_BUDGET_BYTES plus
+    # ALLOC_BUDGET_PER_VOICE pro Stimme bleibt, unabhängig von der Blockgröße. Events mitten
+    # im Block teilen ihn wie beim Playback, dazu laufen Pitch Bend, Vibrato und ein
+    # ständiges Gleiten der Lautstärke.
+    synth = RetroSynth()
+    synth.sample_rate = sample_rate
+    synth.max_polyphony = max(synth.max_polyphony, voices)
+    synth.oscillator = oscillator
+    bench_patch(synth, patch)
+    for ch in range(1, 16, 2):
+        synth.channel_settings[ch]["vibrato_depth"] = 0.3
+    # Zwei Patches mit anderer Lautstärke auf Kanal 0, pro Block getauscht
+    synth.set_channel(0, "volume", 0.6)
+    quiet = synth.patch
+    synth.set_channel(0, "volume", 1.0)
+    patches = (quiet, synth.patch)
+    synth.reset_state()
+    synth.pitch_bend(1, 3000)
+    for v in range(voices):
+        synth.note_on(48 + v, 100, v % 8)
+    outdata = np.zeros((frames, 2), dtype=np.float32)  # wie von sounddevice
+
+    def play(count):
+        for b in range(count):
+            # Anschlag mitten im Block auf einer schon klingenden Stimme (Pool bleibt voll)
+            synth.schedule(synth.current_sample_index + frames // 3, EVENT_NOTE_ON, 48, 100, 0)
+            synth.patch = patches[b % 2]
+            synth.audio_callback(outdata, frames, None, None)
+
+    play(10)  # Puffer anlegen lassen
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        play(blocks)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    budget = ALLOC_BUDGET_BYTES + ALLOC_BUDGET_PER_VOICE * voices
+    return {
+        "bench": "alloc",
+        "voices": voices,
+        "frames": frames,
+        "sample_rate": sample_rate,
+        "patch": patch,
+        "oscillator": oscillator,
+        "peak_bytes": peak - baseline,
+        "retained_bytes": current - baseline,
+        "block_bytes": voices * frames * 4,
+        "budget_bytes": budget,
+        "allocation_free": peak - baseline <= budget,
+    }
+
+
+def benchmark_render(workload="dense", sample_rate=44100, engine="chunk", seconds=10.0, repeat=1):
+    # Kompletter Offline Export (inkl. WAV Writer) eines synthetischen Songs in eine Temp-Datei
+    spec = BENCH_WORKLOADS[workload]
+    song = Song(synthetic_midi(spec["channels"], spec["density"], spec["drums"], seconds))
+    synth = RetroSynth()
+    synth.sample_rate = sample_rate
+    bench_patch(synth, spec["patch"])
+
+    # Stems werden immer kalt gemessen, in einem eigenen, temporären Cache
+    global _stem_cache
+    previous = _stem_cache
+    fd, path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    stem_dir = tempfile.mkdtemp()
+    try:
+        _stem_cache = StemCache(stem_dir)
+        best = float("inf")
+        for _ in range(repeat):
+            _stem_cache.clear()
+            t0 = time.perf_counter()
+            export_song(synth, song, path, engine=engine)
+            best = min(best, time.perf_counter() - t0)
+    finally:
+        _stem_cache = previous
+        os.remove(path)
+        shutil.rmtree(stem_dir, ignore_errors=True)
+
+    return {
+        "bench": "render",
+        "workload": workload,
+        "engine": engine,
+        "sample_rate": sample_rate,
+        "notes": len(song.notes),
+        "duration": song.length,
+        "wall_time": best,
+        "realtime_factor": song.length / best if best > 0 else None,
+    }
+
+
+# Maximale Abweichung zwischen segments und chunk Engine (float32 Rundung)
+SEGMENT_TOLERANCE = 1e-5
+
+
+def benchmark_segments(workload="dense", sample_rate=44100, jobs=4, seconds=30.0):
+    # Paralleler Segment-Export gegen den Export in einem Prozess: gleiche Samples?
+    # Läuft mit festen jobs, damit auch auf einem Kern über mehrere Segmente geprüft wird
+    spec = BENCH_WORKLOADS[workload]
+    song = Song(synthetic_midi(spec["channels"], spec["density"], spec["drums"], seconds))
+    synth = RetroSynth()
+    synth.sample_rate = sample_rate
+    bench_patch(synth, spec["patch"])
+
+    t0 = time.perf_counter()
+    reference = np.concatenate(list(iter_song_chunks(synth, song)))
+    single = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    parallel = np.concatenate(list(iter_song_segments(synth, song, jobs=jobs)))
+    wall = time.perf_counter() - t0
+
+    diff = float(np.max(np.abs(parallel - reference))) if parallel.shape == reference.shape else float("inf")
+    return {
+        "bench": "segments",
+        "workload": workload,
+        "sample_rate": sample_rate,
+        "jobs": jobs,
+        "segments": len(segment_bounds(song, sample_rate, synth.drum_channel,
+                                       min(jobs, int(song.length / SEGMENT_MIN_SECONDS)))),
+        "wall_time": wall,
+        "speedup": single / wall if wall > 0 else None,
+        "max_abs_diff": diff,
+        "equivalent": diff <= SEGMENT_TOLERANCE,
+    }
+
+
+# Maximale Abweichung zwischen chunk und span Engine. Die Blöcke sind verschieden lang,
+# die Phasen runden also etwas anders, das wirkt sich an steilen Flanken aus
+ENGINE_TOLERANCE = 1e-3
+
+
+def benchmark_engines(patch="env", sample_rate=44100, seconds=5.0):
+    # chunk und span Engine auf einem Song mit Noten der Länge 0 und einer Pause am Ende:
+    # gleiche Länge und gleiche Samples?
+    # Wenige Stimmen (kein Voice Stealing), ohne Bitcrusher und bandbegrenzt (beim naiven
+    # Oszillator verschiebt die Phasen-Rundung ganze Flanken um ein Sample)
+    song = Song(synthetic_midi(4, 6.0, 2.0, seconds, zero_length=0.25, tail=2.0))
+    synth = RetroSynth()
+    synth.sample_rate = sample_rate
+    synth.bit_depth = 1000
+    synth.oscillator = "wavetable"
+    bench_patch(synth, patch)
+
+    t0 = time.perf_counter()
+    reference = np.concatenate(list(iter_song_chunks(synth, song)))
+    spans = np.concatenate(list(iter_song_spans(synth, song)))
+    wall = time.perf_counter() - t0
+
+    diff = float(np.max(np.abs(spans - reference))) if spans.shape == reference.shape else float("inf")
+    return {
+        "bench": "engines",
+        "patch": patch,
+        "sample_rate": sample_rate,
+        "zero_length_notes": int(np.sum(song.end_sec == song.start_sec)),
+        "wall_time": wall,
+        "frames": len(reference),
+        "span_frames": len(spans),
+        "same_length": len(spans) == len(reference),
+        "max_abs_diff": diff,
+        "equivalent": diff <= ENGINE_TOLERANCE,
+    }
+
+
+# Hauptmesswert je Benchmark für --compare (kleiner = besser)
+BENCH_METRICS = {"chunk": "us_per_block", "render": "wall_time", "envelope": "block_us_per_voice",
+                 "alloc": "peak_bytes", "segments": "wall_time", "kernel": "us_per_block", "engines": "wall_time"}
+# Prüfungen in den Ergebnissen, ist eine davon False, endet bench mit Exit Code 1
+BENCH_CHECKS = ("equivalent", "same_length", "allocation_free")
+
+
+def bench_key(result):
+    metric = BENCH_METRICS[result["bench"]]
+    skip = {metric, "dsp_load_percent", "realtime_factor", "duration", "loop_us_per_voice", "speedup", "max_abs_diff",
+            "retained_bytes", "block_bytes", "budget_bytes", "allocation_free", "equivalent",
+            "span_frames", "same_length"}
+    return tuple((k, v) for k, v in result.items() if k not in skip)
+
+
+def compare_bench(old, new):
+    # Zeilen "Benchmark: alt -> neu (Faktor)" für alle Messungen, die in beiden Läufen vorkommen
+    old_results = {bench_key(r): r for r in old["results"]}
+    lines = []
+    for r in new["results"]:
+        o = old_results.get(bench_key(r))
+        if o is None:
+            continue
+        metric = BENCH_METRICS[r["bench"]]
+        label = " ".join(f"{k}={v}" for k, v in bench_key(r))
+        ratio = o[metric] / r[metric] if r[metric] > 0 else float("inf")
+        lines.append(f"{label}: {o[metric]:.4g} -> {r[metric]:.4g} {metric} ({ratio:.2f}x)")
+    return lines
+
+
+def run_bench_cli(args):
+    rates = args.rates or ([44100] if args.quick else [22050, 44100, 48000])
+    blocks = args.blocks or ([512] if args.quick else [256, 512, 1024, 4096])
+    voices = args.voices or ([16] if args.quick else [4, 16, 32])
+    workloads = args.workloads or sorted(BENCH_WORKLOADS)
+    seconds = 3.0 if args.quick else 10.0
+    chunk_blocks = 50 if args.quick else 200
+
+    def runs():
+        yield lambda: dict(bench="envelope", **benchmark_envelope())
+        # fused_melody ohne JIT, klein gehalten (Python Schleife), läuft auch ohne numba
+        for kernel in sorted(REFERENCE_KERNELS):
+            yield lambda: benchmark_kernel(kernel, 8, 128, rates[0], blocks=12)
+        for rate in rates:
+            for frames in blocks:
+                for n in voices:
+                    for patch in BENCH_PATCHES:
+                        for kernel in sorted(KERNELS):
+                            yield lambda: benchmark_chunk(n, frames, rate, patch, chunk_blocks, kernel=kernel)
+                for oscillator in OSCILLATORS:
+                    yield lambda: benchmark_allocations(max(voices), frames, rate, oscillator=oscillator)
+                for kernel in sorted(set(KERNELS) - {"numpy"}):
+                    yield lambda: benchmark_kernel(kernel, max(voices), frames, rate)
+            for patch in ("plain", "env"):
+                yield lambda: benchmark_engines(patch, rate, seconds)
+            for workload in workloads:
+                for engine in sorted(ENGINES):
+                    yield lambda: benchmark_render(workload, rate, engine, seconds)
+                yield lambda: benchmark_segments(workload, rate, seconds=max(20.0, 3 * seconds))
+
+    results = []
+    for run in runs():
+        results.append(run())
+        # Fortschritt auf stderr, damit stdout reines JSON bleibt
+        print(json.dumps(results[-1]), file=sys.stderr, flush=True)
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            for line in compare_bench(json.load(f), report):
+                print(line, file=sys.stderr)
+
+    failed = [r for r in results if any(r.get(check) is False for check in BENCH_CHECKS)]
+    for r in failed:
+        print("FEHLGESCHLAGEN: " + json.dumps(r), file=sys.stderr)
+    return 1 if failed else 0
+
+
+METER_INTERVAL_MS = 33  # Pegelanzeige etwa 30 mal pro Sekunde
 
 
 class RetroMidiApp:
     def __init__(self, root):
         self.root = root
         self.root.title("8-BIT STUDIO: FINAL MIX") # mal gucken ob das auffällt
-        self.root.geometry("600x858")
+        self.root.geometry("600x960")
         
         self.bg = "#1e1e1e" 
         self.fg = "#00ffcc" 
@@ -314,13 +3676,20 @@ class RetroMidiApp:
         self.style.map("TButton", background=[("active", self.acc)], foreground=[("active", "white")])
 
         self.synth = RetroSynth()
+        self.synth.meters = ChannelMeters()
         self.channel_active = {ch: False for ch in range(16)}
-        self.synth.note_activity_callback = self.on_channel_activity
-        self.midi_file = None
+        self.meter_shown = {ch: 0.0 for ch in range(16)}
+        self.song = None
+        self.song_path = None
         self.is_playing = False
-        self.total_messages = 0
+        self.sequencer = None
+        self.live = None
+        self.start_pos = 0.0         # Startposition in Sekunden
+        self.loop_points = [0.0, 0.0]
+        self.slider_busy = False     # Slider wird vom Programm gesetzt, kein Seek auslösen
         
         self.setup_ui()
+        self.update_meters()
 
     def setup_ui(self):
         main = ttk.Frame(self.root, padding=15)
@@ -331,8 +3700,13 @@ class RetroMidiApp:
         ttk.Label(top_frame, text="8-BIT STUDIO", font=("Impact", 20), foreground=self.acc).pack(side=tk.LEFT)
         self.lbl_status = ttk.Label(top_frame, text="READY", foreground="#888")
         self.lbl_status.pack(side=tk.RIGHT, padx=10)
+        # Live Statistik: DSP Last, Aussetzer, Stimmen, verschluckte Fehler
+        self.lbl_perf = ttk.Label(top_frame, text="", foreground="#888", font=("Verdana", 8))
+        self.lbl_perf.pack(side=tk.RIGHT, padx=10)
 
         self.style.configure("Active.TButton", background="#0f0", foreground="#000")
+        self.style.configure("Meter.Horizontal.TProgressbar", background=self.fg, troughcolor="#333",
+                             bordercolor="#555", thickness=8)
 
         ctrl_frame = ttk.LabelFrame(main, text=" CONTROLS ", padding=10)
         ctrl_frame.pack(fill=tk.X, pady=5)
@@ -362,6 +3736,23 @@ class RetroMidiApp:
         self.btn_export = ttk.Button(btn_box, text="EXPORT WAV", command=self.export_wav, state=tk.NORMAL)
         self.btn_export.pack(side=tk.LEFT, padx=5)
 
+        # Position: Slider zum Springen/Scrubben, Loop zwischen A und B
+        pos_box = ttk.Frame(ctrl_frame)
+        pos_box.pack(fill=tk.X, pady=(8, 0))
+        self.pos_scale = ttk.Scale(pos_box, from_=0, to=1, command=self.on_position)
+        self.pos_scale.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.lbl_pos = ttk.Label(pos_box, text="0:00 / 0:00", width=12, anchor="e")
+        self.lbl_pos.pack(side=tk.LEFT, padx=5)
+
+        loop_box = ttk.Frame(ctrl_frame)
+        loop_box.pack(pady=(5, 0))
+        self.var_loop = tk.BooleanVar(value=False)
+        ttk.Checkbutton(loop_box, text="Loop", variable=self.var_loop, command=self.update_loop).pack(side=tk.LEFT, padx=5)
+        ttk.Button(loop_box, text="SET A", command=lambda: self.set_loop_point(0)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(loop_box, text="SET B", command=lambda: self.set_loop_point(1)).pack(side=tk.LEFT, padx=5)
+        self.lbl_loop = ttk.Label(loop_box, text="A 0:00  B 0:00")
+        self.lbl_loop.pack(side=tk.LEFT, padx=5)
+
         mix_frame = ttk.LabelFrame(main, text=" MIXER ", padding=10)
         mix_frame.pack(fill=tk.X, pady=5)
         ttk.Label(mix_frame, text="Drum CH:").grid(row=0, column=0)
@@ -373,6 +3764,46 @@ class RetroMidiApp:
         s_bit = ttk.Scale(mix_frame, from_=2, to=64, command=lambda v: setattr(self.synth, 'bit_depth', float(v)))
         s_bit.set(16); s_bit.grid(row=0, column=3, sticky="ew")
 
+        # Blockgröße des Audio Streams, Events bleiben dank Zeitstempel trotzdem sample-genau
+        ttk.Label(mix_frame, text="Block:").grid(row=1, column=0)
+        var_block_size = tk.StringVar(value=self.synth.block_size)
+        block_size_box = ttk.Combobox(mix_frame, values=[64, 128, 256, 512, 1024, 2048, 4096],
+                                      textvariable=var_block_size, state="readonly", width=6)
+        block_size_box.grid(row=1, column=1, padx=5, pady=(5, 0))
+        block_size_box.bind("<<ComboboxSelected>>",
+            lambda e: setattr(self.synth, "block_size", int(var_block_size.get()))
+        )
+
+        # Latenz-Ziel in ms, 0 = direkt im Audio Callback rendern
+        ttk.Label(mix_frame, text="Latency ms:").grid(row=1, column=2)
+        var_latency = tk.StringVar(value=self.synth.latency_ms)
+        latency_box = ttk.Combobox(mix_frame, values=[0, 50, 100, 200, 500],
+                                   textvariable=var_latency, state="readonly", width=6)
+        latency_box.grid(row=1, column=3, sticky="w", pady=(5, 0))
+        latency_box.bind("<<ComboboxSelected>>",
+            lambda e: setattr(self.synth, "latency_ms", int(var_latency.get()))
+        )
+        ttk.Button(mix_frame, text="SAVE STATS", command=self.save_metrics).grid(row=1, column=4, padx=5, pady=(5, 0))
+        ttk.Button(mix_frame, text="EXPORT STEMS", command=self.export_stems).grid(row=0, column=4, padx=5)
+
+        # Live MIDI Eingang (nur mit python-rtmidi)
+        ttk.Label(mix_frame, text="MIDI In:").grid(row=2, column=0)
+        self.var_midi_in = tk.StringVar()
+        ports = LiveInput.ports()
+        midi_in_box = ttk.Combobox(mix_frame, values=ports, textvariable=self.var_midi_in, state="readonly", width=24)
+        if ports: midi_in_box.current(0)
+        midi_in_box.grid(row=2, column=1, columnspan=3, sticky="ew", padx=5, pady=(5, 0))
+        self.btn_live = ttk.Button(mix_frame, text="LIVE", command=self.toggle_live)
+        self.btn_live.grid(row=2, column=4, padx=5, pady=(5, 0))
+        if rtmidi is None: self.btn_live.state(["disabled"])
+
+        # Oszillator: naive (harte Kanten, Aliasing) oder band-limitierte Wavetables
+        ttk.Label(mix_frame, text="Oscillator:").grid(row=3, column=0)
+        var_osc = tk.StringVar(value=self.synth.oscillator)
+        osc_box = ttk.Combobox(mix_frame, values=list(OSCILLATORS), textvariable=var_osc, state="readonly", width=10)
+        osc_box.grid(row=3, column=1, sticky="w", padx=5, pady=(5, 0))
+        osc_box.bind("<<ComboboxSelected>>", lambda e: self.synth.set_param("oscillator", var_osc.get()))
+
         inst_frame = ttk.Frame(main)
         inst_frame.pack(fill=tk.BOTH, expand=True, pady=10)
         
@@ -380,31 +3811,44 @@ class RetroMidiApp:
         f_ch = ttk.LabelFrame(inst_frame, text=" CHANNELS ", padding=5)
         f_ch.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=2)
 
-        self.channel_buttons = []
+        # Pegelanzeige rechts neben jedem Kanal, Kanal -> (Button, Meter)
+        self.channel_widgets = {}
         for i in range(16):
             if i == self.synth.drum_channel:
                 continue
+            row = ttk.Frame(f_ch)
+            row.pack(fill=tk.X, pady=2)
             btn = ttk.Button(
-                f_ch,
+                row,
                 text=f"Channel {i+1}",
                 command=lambda ch=i: self.open_channel_settings(ch)
             )
-            btn.pack(fill=tk.X, pady=2)
-            self.channel_buttons.append(btn)
+            btn.pack(side=tk.LEFT, fill=tk.X, expand=True)
+            meter = ttk.Progressbar(row, style="Meter.Horizontal.TProgressbar", length=50, maximum=1.0)
+            meter.pack(side=tk.LEFT, padx=(4, 0))
+            self.channel_widgets[i] = (btn, meter)
 
         # KICK
         f_kick = ttk.LabelFrame(inst_frame, text=" KICK ", padding=5)
         f_kick.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=2)
-        self.create_slider(f_kick, "Volume", 0, 2.0, 1.0, lambda v: setattr(self.synth, 'kick_vol', float(v)))
-        self.create_combo(f_kick, "Type", ["Triangle", "Sine", "Pulse", "Noise"], "Triangle", lambda e,v: setattr(self.synth, 'kick_type', v.get()))
-        self.create_slider(f_kick, "Decay", 0.05, 1.0, 0.15, lambda v: setattr(self.synth, 'kick_decay', float(v)))
+        self.create_slider(f_kick, "Volume", 0, 2.0, 1.0, lambda v: self.synth.set_param('kick_vol', float(v)))
+        self.create_combo(f_kick, "Type", ["Triangle", "Sine", "Pulse", "Noise"], "Triangle", lambda e,v: self.set_drum_param('kick_type', v.get()))
+        self.create_slider(f_kick, "Decay", 0.05, 1.0, 0.15, lambda v: self.set_drum_param('kick_decay', float(v)))
+        self.create_slider(f_kick, "Noise Period", 0, 15, 0, lambda v: self.set_drum_param('kick_noise_period', int(float(v))))
 
         # SNARE
         f_snare = ttk.LabelFrame(inst_frame, text=" SNARE ", padding=5)
         f_snare.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=2)
-        self.create_slider(f_snare, "Volume", 0, 2.0, 0.8, lambda v: setattr(self.synth, 'snare_vol', float(v)))
-        self.create_combo(f_snare, "Type", ["White Noise", "Digital", "Metal"], "White Noise", lambda e,v: setattr(self.synth, 'snare_type', v.get()))
-        self.create_slider(f_snare, "Body/Punch", 0.0, 1.0, 0.5, lambda v: setattr(self.synth, 'snare_body', float(v)))
+        self.create_slider(f_snare, "Volume", 0, 2.0, 0.8, lambda v: self.synth.set_param('snare_vol', float(v)))
+        self.create_combo(f_snare, "Type", ["White Noise", "Digital", "Metal"], "White Noise", lambda e,v: self.set_drum_param('snare_type', v.get()))
+        self.create_slider(f_snare, "Body/Punch", 0.0, 1.0, 0.5, lambda v: self.set_drum_param('snare_body', float(v)))
+        self.create_slider(f_snare, "Noise Period", 0, 15, 0, lambda v: self.set_drum_param('snare_noise_period', int(float(v))))
+
+    def set_drum_param(self, name, value):
+        # Klang der Drums ändert sich, vorgerenderte Hits verwerfen
+        with self.synth.lock:
+            self.synth.set_param(name, value)
+            self.synth.drum_cache.clear()
 
     def create_slider(self, parent, label, min_v, max_v, default, cmd):
         ttk.Label(parent, text=label).pack(anchor="w")
@@ -418,17 +3862,19 @@ class RetroMidiApp:
     def open_channel_settings(self, ch):
         win = tk.Toplevel(self.root)
         win.title(f"Channel {ch+1} Settings")
-        win.geometry("300x504")
+        win.geometry("300x600")
         win.configure(bg=self.bg)
 
         cs = self.synth.channel_settings[ch]
+        # Änderungen gehen über den Synth, damit er einen neuen Patch veröffentlicht
+        set_cs = lambda key, value: self.synth.set_channel(ch, key, value)
 
         # --- Volume ---
         ttk.Label(win, text="Volume").pack(anchor="w")
         vol = ttk.Scale(win, from_=0.0, to=1.5)
         vol.set(cs["volume"])
         vol.pack(fill=tk.X)
-        vol.configure(command=lambda v: cs.__setitem__("volume", float(v)))
+        vol.configure(command=lambda v: set_cs("volume", float(v)))
 
         # --- Waveform ---
         ttk.Label(win, text="Waveform").pack(anchor="w", pady=(10,0))
@@ -436,7 +3882,7 @@ class RetroMidiApp:
         box = ttk.Combobox(win, values=["Pulse","Triangle","Sawtooth"], textvariable=var_wave, state="readonly")
         box.pack(fill=tk.X)
         box.bind("<<ComboboxSelected>>",
-                 lambda e: (cs.__setitem__("waveform", var_wave.get()), pulse_slider.configure(state="normal" if var_wave.get()=="Pulse" else "disabled")))
+                 lambda e: (set_cs("waveform", var_wave.get()), pulse_slider.configure(state="normal" if var_wave.get()=="Pulse" else "disabled")))
 
         # --- Pulse Width ---
         ttk.Label(win, text="Pulse Width").pack(anchor="w", pady=(10,0))
@@ -444,7 +3890,7 @@ class RetroMidiApp:
         pulse_slider.set(cs["pulse_width"])
         pulse_slider.pack(fill=tk.X)
         pulse_slider.configure(
-            command=lambda v: cs.__setitem__("pulse_width", float(v)),
+            command=lambda v: set_cs("pulse_width", float(v)),
             state="normal" if cs["waveform"] == "Pulse" else "disabled"
         )
         
@@ -453,122 +3899,216 @@ class RetroMidiApp:
         pan = ttk.Scale(win, from_=-1.0, to=1.0)
         pan.set(cs["pan"])
         pan.pack(fill=tk.X)
-        pan.configure(command=lambda v: cs.__setitem__("pan", float(v)))
+        pan.configure(command=lambda v: set_cs("pan", float(v)))
 
 
         # --- Envelope Enable ---
         env_var = tk.BooleanVar(value=cs["env_enabled"])
         env_chk = ttk.Checkbutton(win, text="Enable Envelope", variable=env_var)
         env_chk.pack(anchor="w", pady=(10,0))
-        env_chk.config(command=lambda: cs.__setitem__("env_enabled", env_var.get()))
+        env_chk.config(command=lambda: set_cs("env_enabled", env_var.get()))
 
-        # ADSR sliders
-        def add_env_slider(label, key, minv, maxv):
+        # Schieberegler für eine Kanaleinstellung (ADSR, Vibrato)
+        def add_slider(label, key, minv, maxv):
             ttk.Label(win, text=label).pack(anchor="w")
             s = ttk.Scale(win, from_=minv, to=maxv)
             s.set(cs[key])
             s.pack(fill=tk.X)
-            s.configure(command=lambda v: cs.__setitem__(key, float(v)))
+            s.configure(command=lambda v: set_cs(key, float(v)))
             return s
 
-        attack  = add_env_slider("Attack", "attack", 0.001, 1.0)
-        decay   = add_env_slider("Decay", "decay", 0.001, 1.0)
-        sustain = add_env_slider("Sustain", "sustain", 0.0, 1.0)
-        release = add_env_slider("Release", "release", 0.001, 1.5)
+        # ADSR sliders
+        attack  = add_slider("Attack", "attack", 0.001, 1.0)
+        decay   = add_slider("Decay", "decay", 0.001, 1.0)
+        sustain = add_slider("Sustain", "sustain", 0.0, 1.0)
+        release = add_slider("Release", "release", 0.001, 1.5)
 
 
         # --- Pulse Width Automation ---
         pw_enabled = tk.BooleanVar(value=cs["pw_enabled"])
         pw_chk = ttk.Checkbutton(win, text="Enable PW Automation", variable=pw_enabled)
         pw_chk.pack(anchor="w", pady=(10,0))
-        pw_chk.config(command=lambda: cs.__setitem__("pw_enabled", pw_enabled.get()))
+        pw_chk.config(command=lambda: set_cs("pw_enabled", pw_enabled.get()))
 
         # PW Start
         ttk.Label(win, text="PW Start").pack(anchor="w")
         pw_s = ttk.Scale(win, from_=0.01, to=0.99)
         pw_s.set(cs["pw_start"])
         pw_s.pack(fill=tk.X)
-        pw_s.configure(command=lambda v: cs.__setitem__("pw_start", float(v)))
+        pw_s.configure(command=lambda v: set_cs("pw_start", float(v)))
 
         # PW Stop
         ttk.Label(win, text="PW Stop").pack(anchor="w")
         pw_e = ttk.Scale(win, from_=0.01, to=0.99)
         pw_e.set(cs["pw_stop"])
         pw_e.pack(fill=tk.X)
-        pw_e.configure(command=lambda v: cs.__setitem__("pw_stop", float(v)))
+        pw_e.configure(command=lambda v: set_cs("pw_stop", float(v)))
 
         # PW Bounce
         pw_bounce = tk.BooleanVar(value=cs["pw_bounce"])
         chk_bounce = ttk.Checkbutton(win, text="PW Bounce", variable=pw_bounce)
         chk_bounce.pack(anchor="w")
-        chk_bounce.config(command=lambda: cs.__setitem__("pw_bounce", pw_bounce.get()))
+        chk_bounce.config(command=lambda: set_cs("pw_bounce", pw_bounce.get()))
 
         # PW Bounce Time
         ttk.Label(win, text="PW Bounce Time").pack(anchor="w")
         pw_bt = ttk.Scale(win, from_=0.05, to=1.0)
         pw_bt.set(cs["pw_bounce_time"])
         pw_bt.pack(fill=tk.X)
-        pw_bt.configure(command=lambda v: cs.__setitem__("pw_bounce_time", float(v)))
-
-    def on_channel_activity(self, ch, active):
-        # Da TCL/TK nicht selbst threaded ist, Synth von UI separieren
-        self.root.after(0, lambda: self._update_channel_button(ch, active))
-
-    def _update_channel_button(self, ch, active):
-        self.channel_active[ch] = active
-        btn_index = ch if ch < self.synth.drum_channel else ch-1
-        btn = self.channel_buttons[btn_index]
-        if active:
-            btn.config(style="Active.TButton")
-        else:
-            btn.config(style="TButton")
+        pw_bt.configure(command=lambda v: set_cs("pw_bounce_time", float(v)))
+
+        # --- Vibrato ---
+        ttk.Label(win, text="Vibrato").pack(anchor="w", pady=(10,0))
+        add_slider("Vibrato Depth (semitones)", "vibrato_depth", 0.0, 1.0)
+        add_slider("Vibrato Rate (Hz)", "vibrato_rate", 0.5, 12.0)
+
+    def update_meters(self):
+        # Pegel des Audio Threads mit ~30 Hz abholen, Tk nur anfassen wenn sich etwas ändert
+        meters = self.synth.meters
+        for ch, (btn, meter) in self.channel_widgets.items():
+            active = bool(meters.voices[ch])
+            if active != self.channel_active[ch]:
+                self.channel_active[ch] = active
+                btn.config(style="Active.TButton" if active else "TButton")
+            # -48 dBFS .. 0 dBFS auf 0 .. 1
+            value = float(np.clip(1.0 + 20.0 * np.log10(max(meters.level[ch], 1e-6)) / 48.0, 0.0, 1.0))
+            if abs(value - self.meter_shown[ch]) > 0.01:
+                self.meter_shown[ch] = value
+                meter.config(value=value)
+        self.root.after(METER_INTERVAL_MS, self.update_meters)
 
     def load_midi(self):
         path = filedialog.askopenfilename(filetypes=[("MIDI", "*.mid"), ("All Files", "*.*")])
         if path:
             try:
-                self.midi_file = mido.MidiFile(path)
+                self.song = Song.load(path)
+                self.song_path = path
                 self.lbl_file.config(text=path.split('/')[-1])
-                self.lbl_status.config(text="FILE OK.", foreground="#0f0")
-                # Zähle Nachrichten für Progress Bar Berechnung
-                self.total_messages = sum(1 for _ in self.midi_file)
+                mins, secs = divmod(int(self.song.length), 60)
+                self.lbl_status.config(text=f"FILE OK. {mins}:{secs:02d}", foreground="#0f0")
+                self.start_pos = 0.0
+                self.loop_points = [0.0, self.song.length]
+                self.pos_scale.configure(to=max(self.song.length, 0.001))
+                self.set_slider(0.0)
+                self.update_loop()
             except Exception as e:
                 traceback.print_exc()
                 messagebox.showerror("Error", str(e))
 
+    def toggle_live(self):
+        if self.live:
+            self.live.stop()
+            self.live = None
+            self.is_playing = False
+            self.btn_live.config(text="LIVE")
+            self.lbl_status.config(text="STOPPED")
+            return
+        if self.is_playing:
+            self.stop_internal()
+        try:
+            self.live = LiveInput(self.synth, self.var_midi_in.get() or None)
+            name = self.live.start()
+        except Exception as e:
+            self.live = None
+            messagebox.showerror("MIDI In", str(e))
+            return
+        self.is_playing = True
+        self.btn_live.config(text="STOP LIVE")
+        self.lbl_status.config(text=f"LIVE: {name}", foreground=self.fg)
+        self.update_metrics()
+
     def toggle_play(self):
-        if not self.midi_file: return
+        if not self.song or self.live: return
         if self.is_playing:
             self.stop_internal()
         else:
             self.is_playing = True
             self.synth.reset_state()
             self.synth.start_stream()
-            threading.Thread(target=self.play_thread, daemon=True).start()
+            start = int(self.start_pos * self.synth.sample_rate)
+            self.sequencer = Sequencer(self.synth, self.song, start)
+            self.update_loop()
+            threading.Thread(target=self.play_thread, args=(self.sequencer,), daemon=True).start()
             self.btn_play.config(text="STOP")
             self.lbl_status.config(text="PLAYING...", foreground=self.fg)
+            self.update_metrics()
+            self.update_position()
 
-    def play_thread(self):
+    def play_thread(self, sequencer):
         try:
-            for msg in self.midi_file.play():
-                if not self.is_playing: break
-                ch = getattr(msg, 'channel', -1)
-                
-                if msg.type == 'note_on' and msg.velocity > 0:
-                    self.synth.note_on(msg.note, msg.velocity, ch)
-                elif msg.type == 'note_off' or (msg.type=='note_on' and msg.velocity==0):
-                    self.synth.note_off(msg.note)
-            self.root.after(0, lambda: self.stop_internal())
+            sequencer.run()
+            if sequencer.running:
+                # Song zu Ende gespielt, nächstes Mal wieder von vorne
+                self.start_pos = 0.0
+                self.root.after(0, lambda: (self.stop_internal(), self.set_slider(0.0)))
         except Exception as e: print(e)
 
+    def on_position(self, value):
+        if self.slider_busy or not self.song: return
+        self.start_pos = float(value)
+        if self.is_playing and self.sequencer:
+            self.sequencer.seek(self.start_pos * self.synth.sample_rate)
+        self.update_position_label(self.start_pos)
+
+    def set_slider(self, seconds):
+        self.slider_busy = True
+        try:
+            self.pos_scale.set(seconds)
+        finally:
+            self.slider_busy = False
+        self.update_position_label(seconds)
+
+    def update_position_label(self, seconds):
+        length = self.song.length if self.song else 0
+        self.lbl_pos.config(text=f"{format_time(seconds)} / {format_time(length)}")
+
+    def update_position(self):
+        if not self.is_playing or not self.sequencer: return
+        seconds = max(0.0, self.sequencer.position() / self.synth.sample_rate)
+        self.start_pos = seconds
+        self.set_slider(seconds)
+        self.root.after(100, self.update_position)
+
+    def set_loop_point(self, which):
+        self.loop_points[which] = self.start_pos
+        self.update_loop()
+
+    def update_loop(self):
+        a, b = self.loop_points
+        self.lbl_loop.config(text=f"A {format_time(a)}  B {format_time(b)}")
+        if self.sequencer:
+            sr = self.synth.sample_rate
+            self.sequencer.loop = (int(a * sr), int(b * sr)) if self.var_loop.get() and b > a else None
+
+    def update_metrics(self):
+        m = self.synth.metrics
+        text = f"DSP {100 * m.load:.0f}% | XRUN {m.underruns + m.overruns} | V {m.voices} | ERR {m.exceptions}"
+        if self.live:
+            self.live.update_latency()
+            if m.input_latencies:
+                text += f" | LAT {1000 * m.input_latency:.0f} ms"
+        self.lbl_perf.config(text=text)
+        if self.is_playing:
+            self.root.after(500, self.update_metrics)
+
+    def save_metrics(self):
+        path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON", "*.json")])
+        if not path: return
+        try:
+            self.synth.metrics.dump(path)
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+
     def stop_internal(self):
         self.is_playing = False
+        if self.sequencer:
+            self.sequencer.running = False
         self.synth.stop_stream()
         self.btn_play.config(text="PLAY")
         self.lbl_status.config(text="STOPPED")
 
     def export_wav(self):
-        if not self.midi_file:
+        if not self.song:
             messagebox.showwarning("Info", "Keine Datei geladen.")
             return
         
@@ -582,70 +4122,49 @@ class RetroMidiApp:
         self.root.update()
         threading.Thread(target=self.render_thread, args=(path,)).start()
 
+    def export_stems(self):
+        if not self.song:
+            messagebox.showwarning("Info", "Keine Datei geladen.")
+            return
+
+        if self.is_playing:
+            self.stop_internal()
+
+        out_dir = filedialog.askdirectory()
+        if not out_dir: return
+
+        self.lbl_status.config(text="STARTING...", foreground=self.acc)
+        threading.Thread(target=self.stems_thread, args=(out_dir, current_settings(self.synth))).start()
+
+    def stems_thread(self, out_dir, settings):
+        try:
+            def progress(fraction):
+                self.root.after(0, lambda txt=f"STEMS: {int(fraction * 100)}%": self.lbl_status.config(text=txt))
+
+            summary = export_stems(self.song_path, out_dir, settings, mixdown=True, progress=progress)
+            print(json.dumps(summary, indent=2))
+            peaks = "\n".join(f"{st['name']}: {st['peak_dbfs']:.1f} dBFS" for st in summary["stems"] if st["peak_dbfs"] is not None)
+            self.root.after(0, lambda: messagebox.showinfo("Success", f"Gespeichert in: {out_dir}\n\nPeaks:\n{peaks}"))
+            self.root.after(0, lambda: self.lbl_status.config(text="DONE", foreground="#888"))
+
+        except Exception as e:
+            traceback.print_exc()
+            err_msg = str(e)
+            self.root.after(0, lambda err=err_msg: messagebox.showerror("Export Failed", err))
+            self.root.after(0, lambda: self.lbl_status.config(text="ERROR", foreground="red"))
+
     def render_thread(self, filename):
         try:
-            self.synth.stop_stream()
-            self.synth.reset_state()
-            
-            buffer = []
             print(f"Starte Export nach: {filename}")
-            
-            count = 0
-            
-            for msg in self.midi_file:
-                count += 1
-                if count % 200 == 0:
-                    p = (count / self.total_messages) * 100
-                    print(f"Export: {int(p)}%...")
-                    self.root.after(0, lambda txt=f"EXP: {int(p)}%": self.lbl_status.config(text=txt))
-
-                delta = int(msg.time * self.synth.sample_rate)
-                
-                if delta > 0:
-                    # Stereo ausgabe
-                    chunk_l, chunk_r = self.synth.generate_chunk(delta, self.synth.current_sample_index)
-                    if len(chunk_l) > 0 and len(chunk_r) > 0:
-                        stereo_chunk = np.column_stack([chunk_l, chunk_r])
-                        buffer.append(stereo_chunk)
-                        self.synth.current_sample_index += delta
-                
-                ch = getattr(msg, 'channel', -1)
-                
-                try:
-                    if msg.type == 'note_on':
-                        if msg.velocity > 0: 
-                            self.synth.note_on(msg.note, msg.velocity, ch)
-                        else: 
-                            self.synth.note_off(msg.note)
-                    elif msg.type == 'note_off': 
-                        self.synth.note_off(msg.note)
-                except Exception:
-                    pass
-
-            # Letzter Ausklang
-            print("Rendering Ausklang...")
-            chunk_l, chunk_r = self.synth.generate_chunk(int(self.synth.sample_rate), self.synth.current_sample_index)
-            stereo_chunk = np.column_stack([chunk_l, chunk_r])
-            buffer.append(stereo_chunk)
-            
-            if len(buffer) == 0:
-                raise Exception("Keine Audio-Daten generiert! Ist die MIDI Datei leer?")
-
-            print("Zusammenfügen...")
-            full = np.concatenate(buffer, axis=0)  # (samples, 2)
-            
-            print("Normalisieren...")
-            m = np.max(np.abs(full))
-            if m > 0:
-                full = full / m * 0.95
-            
-            print("Speichern...")
-            with wave.open(filename, 'w') as f:
-                f.setnchannels(2) # 2 weil Stereo
-                f.setsampwidth(2)
-                f.setframerate(self.synth.sample_rate)
-                f.writeframes((full * 32767).astype(np.int16).tobytes())
-            
+
+            def progress(fraction):
+                p = fraction * 100
+                print(f"Export: {int(p)}%...")
+                self.root.after(0, lambda txt=f"EXP: {int(p)}%": self.lbl_status.config(text=txt))
+
+            # Stems: nach dem Ändern eines Kanals wird nur dieser Kanal neu gerendert
+            export_song(self.synth, self.song, filename, progress=progress, engine="stems")
+
             print("Fertig!")
             self.root.after(0, lambda f=filename: messagebox.showinfo("Success", f"Gespeichert: {f}"))
             self.root.after(0, lambda: self.lbl_status.config(text="DONE", foreground="#888"))
@@ -657,8 +4176,90 @@ class RetroMidiApp:
             self.root.after(0, lambda err=err_msg: messagebox.showerror("Export Failed", err))
             self.root.after(0, lambda: self.lbl_status.config(text="ERROR", foreground="red"))
 
-if __name__ == "__main__":
+def run_gui():
+    if tk is None:
+        raise SystemExit("tkinter ist nicht installiert, bitte 'render' für den Headless Export benutzen")
     root = tk.Tk()
     app = RetroMidiApp(root)
-    root.protocol("WM_DELETE_WINDOW", lambda: (app.synth.stop_stream(), root.destroy()))
+    root.protocol("WM_DELETE_WINDOW", lambda: (app.live and app.live.close(), app.synth.stop_stream(), root.destroy()))
     root.mainloop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="8-Bit Studio: MIDI to Chiptune")
+    sub = parser.add_subparsers(dest="command")
+
+    p_render = sub.add_parser("render", help="MIDI Dateien headless als WAV rendern")
+    p_render.add_argument("inputs", nargs="+", help="MIDI Datei(en)")
+    p_render.add_argument("-o", "--output", help="WAV Datei (eine Eingabe) oder Zielordner (mehrere)")
+    p_render.add_argument("--rate", type=int, help="Sample Rate, z.B. 44100")
+    p_render.add_argument("--settings", help="JSON Patch mit Synth/Kanal Einstellungen")
+    p_render.add_argument("-j", "--jobs", type=int, help="Anzahl Worker-Prozesse (Default: alle Kerne)")
+    p_render.add_argument("--format", choices=["int16", "float32"], default="int16", help="Sample Format der WAV Datei")
+    p_render.add_argument("--normalize", choices=["peak", "fixed", "limit"], default="peak",
+                          help="peak = zwei Durchgänge auf 0.95, fixed = feste Verstärkung, limit = Verstärkung + Limiter")
+    p_render.add_argument("--gain", type=float, default=0.5, help="Verstärkung für fixed/limit")
+    p_render.add_argument("--engine", choices=sorted(ENGINES), default="chunk",
+                          help="chunk = Event für Event wie beim Playback, span = jede Note über ihre Lebensdauer, "
+                               "stems = wie span mit Stem Cache pro Kanal (nur geänderte Kanäle neu rendern), "
+                               "segments = wie chunk, aber Zeitsegmente parallel in --jobs Worker-Prozessen")
+
+    p_stems = sub.add_parser("stems", help="Eine WAV pro Kanal (plus Kick/Snare) parallel rendern")
+    p_stems.add_argument("input", help="MIDI Datei")
+    p_stems.add_argument("-o", "--output", help="Zielordner (Default: <datei>_stems)")
+    p_stems.add_argument("--rate", type=int, help="Sample Rate, z.B. 44100")
+    p_stems.add_argument("--settings", help="JSON Patch mit Synth/Kanal Einstellungen")
+    p_stems.add_argument("-j", "--jobs", type=int, help="Anzahl Worker-Prozesse (Default: alle Kerne)")
+    p_stems.add_argument("--format", choices=["int16", "float32"], default="int16", help="Sample Format der WAV Dateien")
+    p_stems.add_argument("--normalize", choices=["peak", "fixed", "limit"], default="fixed",
+                         help="fixed (Default) behält die Pegel der Stems zueinander, peak normalisiert jeden Stem einzeln")
+    p_stems.add_argument("--gain", type=float, default=0.5, help="Verstärkung für fixed/limit")
+    p_stems.add_argument("--mixdown", action="store_true", help="Zusätzlich den Mix aus den Stems schreiben")
+    p_stems.add_argument("--crush-stems", action="store_true",
+                         help="Bitcrusher auch auf jeden Stem einzeln (Default: nur Mixdown, Stems summieren sich zum Mix)")
+
+    p_live = sub.add_parser("live", help="MIDI Eingang live spielen und Latenz messen")
+    p_live.add_argument("--list", action="store_true", help="MIDI Eingänge auflisten")
+    p_live.add_argument("--port", help="Nummer oder Teil des Namens des MIDI Eingangs (Default: erster)")
+    p_live.add_argument("--block", type=int, default=128, help="Blockgröße des Audio Streams (klein = wenig Latenz)")
+    p_live.add_argument("--rate", type=int, help="Sample Rate, z.B. 44100")
+    p_live.add_argument("--settings", help="JSON Patch mit Synth/Kanal Einstellungen")
+
+    p_serve = sub.add_parser("serve", help="Render Daemon mit warmen Worker-Prozessen (HTTP auf localhost)")
+    p_serve.add_argument("--port", type=int, default=8765, help="TCP Port auf 127.0.0.1")
+    p_serve.add_argument("--socket", help="Stattdessen auf diesem UNIX Socket lauschen")
+    p_serve.add_argument("-j", "--jobs", type=int, help="Anzahl Worker-Prozesse (Default: alle Kerne)")
+
+    sub.add_parser("bench-envelope", help="Envelope Benchmark (Block vs. Sample-Schleife)")
+
+    p_bench = sub.add_parser("bench", help="Synthese Benchmark mit synthetischen Songs, Ergebnis als JSON")
+    p_bench.add_argument("-o", "--output", help="JSON Datei (Default: stdout)")
+    p_bench.add_argument("--compare", help="Ergebnis eines früheren Laufs, Unterschiede gehen auf stderr")
+    p_bench.add_argument("--quick", action="store_true", help="Nur 44100 Hz, 512 Frames, 16 Stimmen, kurze Songs")
+    p_bench.add_argument("--rates", type=int, nargs="+", help="Sample Rates")
+    p_bench.add_argument("--blocks", type=int, nargs="+", help="Blockgrößen für generate_chunk")
+    p_bench.add_argument("--voices", type=int, nargs="+", help="Anzahl Stimmen für generate_chunk")
+    p_bench.add_argument("--workloads", nargs="+", choices=sorted(BENCH_WORKLOADS), help="Songs für den Offline Export")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "render":
+        return run_render_cli(args)
+    if args.command == "stems":
+        return run_stems_cli(args)
+    if args.command == "bench":
+        return run_bench_cli(args)
+    if args.command == "live":
+        return run_live_cli(args)
+    if args.command == "serve":
+        return run_serve_cli(args)
+    if args.command == "bench-envelope":
+        print(json.dumps(benchmark_envelope(), indent=2))
+        return 0
+
+    run_gui()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())